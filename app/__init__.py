@@ -1,5 +1,5 @@
 from flask import Flask, Blueprint,send_from_directory
-from app.extensions import db, login_manager
+from app.extensions import db, login_manager, socketio
 from app.config import DevConfig, ProdConfig
 
 from app.function.template import template_bp
@@ -9,6 +9,7 @@ from app.function.payment_gateway import payment_bp
 from app.function.board_router import board_router_bp
 from app.function.twilio_service import twilio_bp
 from app.function.fahui_router import fahui_router_bp
+from app.function.board_socket import BoardNamespace
 from app.function.config import flask_path
 import os
 
@@ -28,6 +29,8 @@ def create_app(env="dev"):
     # init extensions
     db.init_app(app)
     login_manager.init_app(app)
+    socketio.init_app(app, message_queue=app.config.get("SOCKETIO_MESSAGE_QUEUE"))
+    socketio.on_namespace(BoardNamespace(BoardNamespace.NAMESPACE))
 
     # ===== api root blueprint（一定要在函数里创建）=====
     api_root_bp = Blueprint("api_root", __name__)
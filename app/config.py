@@ -3,6 +3,8 @@ from _token import SECRET_KEY
 class BaseConfig:
     SECRET_KEY = SECRET_KEY
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # 多个 worker 进程之间通过本机 Redis 转发 socket 广播
+    SOCKETIO_MESSAGE_QUEUE = "redis://localhost:6379/0"
 
 
 class DevConfig(BaseConfig):
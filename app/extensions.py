@@ -1,5 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
+from flask_socketio import SocketIO
 
 db = SQLAlchemy()
 login_manager = LoginManager()
+socketio = SocketIO()
@@ -1,17 +1,29 @@
+import json
 from datetime import datetime
-from flask import send_file, current_app, Blueprint, jsonify,request
+from flask import send_file, current_app, Blueprint, jsonify,request, Response, stream_with_context
 from flask_login import login_required,current_user
 from app.models.fahui import Order,ItemFormData,OrderItem,PrintPDF,PDFPageData,BoardData,BoardHeader
 from app.extensions import db
 from app.function.config import verification_required
-from sqlalchemy import text
+from sqlalchemy import text, update, bindparam
 
 from app.services.order_service import OrderService
+from app.services.order_search_service import OrderSearchService
+from app.services.order_export_service import OrderExportService
+from app.services.order_carry_over_service import OrderCarryOverService
 from app.services.board_service import BoardService
+from app.function.board_socket import broadcast_slot_change
+from app.services.table_generation_service import conditional_get
 
 board_router_bp = Blueprint('board_router', __name__)
 
+# ⚡️ 只读接口依赖的表：任何一张有写入提交，ETag 就变
+# orders 也算进去：删订单时 order_items / pdf_page_data 是数据库级联删的，不走 ORM 事件
+PRINT_DATA_TABLES = ("print_pdf", "pdf_page_data", "order_items", "orders")
+BOARD_TABLES = ("board_header", "board_data", "board_revision", "item_form_data") + PRINT_DATA_TABLES
+
 @board_router_bp.route("/get_pdf_data/<int:pdf_id>", methods=["GET"])
+@conditional_get(*PRINT_DATA_TABLES)
 def get_pdf_data(pdf_id):
     pdf = PrintPDF.query.get(pdf_id)
     if not pdf:
@@ -29,21 +41,43 @@ def delete_board(board_data_id):
         if not board:
             return jsonify({"status": "error", "message": f"BoardData {board_data_id} not found"}), 404
 
+        board_id = board.board_id
         db.session.delete(board)
+        revision = BoardService.bump_revision([board_id])
         db.session.commit()
 
+        # ⚡️ 只回传受影响的板，并推送给订阅了这块板的终端
+        boards = BoardService.get_all_boards_with_orders([board_id])
+        broadcast_slot_change("delete", revision, boards, side_id=board_data_id)
+
         return jsonify({
             "status": "success",
             "message": f"BoardData {board_data_id} deleted successfully",
-            "all_board": BoardService.get_all_boards_with_orders()
+            "revision": revision,
+            "boards": boards
         })
     except Exception as e:
         db.session.rollback()
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @board_router_bp.route("/list_all", methods=["GET"])
+@conditional_get(*BOARD_TABLES)
 def list_all_boards():
-    return jsonify({"all_board": BoardService.get_all_boards_with_orders()})
+    # ?since=<rev>：只返回该 revision 之后改动过的板
+    since = request.args.get("since", type=int)
+    revision = BoardService.current_revision()
+
+    if since is not None:
+        return jsonify({
+            "since": since,
+            "revision": revision,
+            "boards": BoardService.get_boards_since(since) if since < revision else []
+        })
+
+    return jsonify({
+        "revision": revision,
+        "all_board": BoardService.get_all_boards_with_orders()
+    })
 
 @board_router_bp.route("/insert_pdf", methods=["POST"])
 def insert_pdf():
@@ -62,43 +96,42 @@ def insert_pdf():
     except ValueError:
         return jsonify({"error": "参数必须是整数"}), 400
 
+    # ⚡️ 锁住这块板：同一块板的拖动排队执行，不会出现重复的位置
+    if not BoardService.lock_board(board_id):
+        db.session.rollback()
+        return jsonify({"error": f"board_id={board_id} 不存在"}), 400
+
     # 找到目标 pdf
     entry = BoardData.query.filter_by(print_pdf_id=pdf_id, board_id=board_id).first()
     if not entry:
+        db.session.rollback()
         return jsonify({"error": f"pdf_id={pdf_id} 不存在于 board_id={board_id}"}), 400
 
     old_location = entry.location
 
     if old_location == location:
+        db.session.rollback()
         return jsonify({"success": True, "message": "位置未改变"})
 
-    # 向前移动 / 向后移动
-    if old_location < location:
-        # 往后拖动：区间内 -1
-        BoardData.query.filter(
-            BoardData.board_id == board_id,
-            BoardData.location > old_location,
-            BoardData.location <= location
-        ).update({BoardData.location: BoardData.location - 1}, synchronize_session=False)
-    else:
-        # 往前拖动：区间内 +1
-        BoardData.query.filter(
-            BoardData.board_id == board_id,
-            BoardData.location >= location,
-            BoardData.location < old_location
-        ).update({BoardData.location: BoardData.location + 1}, synchronize_session=False)
-
-    # 设置新位置
-    entry.location = location
+    # 只改这一行的 sort_key（间隔用完才整板重排），其它位置的序号自然顺延
+    location = BoardService.move_slot(entry, location)
 
+    revision = BoardService.bump_revision([board_id])
     db.session.commit()
 
+    boards = BoardService.get_all_boards_with_orders([board_id])
+    broadcast_slot_change(
+        "move", revision, boards,
+        side_id=entry.id, print_pdf_id=pdf_id, old_location=old_location, location=location
+    )
+
     return jsonify({
         "success": True,
         "board_id": board_id,
         "pdf_id": pdf_id,
         "location": location,
-        "all_board": BoardService.get_all_boards_with_orders()
+        "revision": revision,
+        "boards": boards
     })
 
 @board_router_bp.route("/add_pdf", methods=["POST"])
@@ -145,8 +178,8 @@ def add_pdf():
         if existing:
             return jsonify({"error": f"pdf_id={pdf_id} 已经绑定在 board_id={existing.board_id} 上"}), 400
 
-    # 查找或创建 BoardHeader
-    header = BoardHeader.query.get(board_id)
+    # 查找或创建 BoardHeader（已存在就锁住，和拖动排队）
+    header = BoardService.lock_board(board_id)
     if not header:
         if not board_name:  
             board_name = f"board_{board_id}"
@@ -176,25 +209,30 @@ def add_pdf():
         if board_entry:
             board_entry.print_pdf_id = pdf_id
         else:
-            # ✅ 获取该 board_id 下最大的 location
-            last_location = db.session.query(db.func.max(BoardData.location)) \
-                                    .filter_by(board_id=header.id).scalar() or 0
-
             board_entry = BoardData(
                 board_id=header.id,
                 print_pdf_id=pdf_id,
-                location=last_location + 1   # ⚡ 自动递增
+                sort_key=BoardService.next_sort_key(header.id)   # ⚡ 排到最后
             )
             db.session.add(board_entry)
 
-
+    revision = BoardService.bump_revision([header.id])
     db.session.commit()
 
+    boards = BoardService.get_all_boards_with_orders([header.id])
+    broadcast_slot_change(
+        "add", revision, boards,
+        side_id=board_entry.id if board_entry else None,
+        print_pdf_id=pdf_id,
+        location=board_entry.location if board_entry else None
+    )
+
     payload = {
         "side_id": board_entry.id if board_entry else None,
         "pdf_id": pdf_id,
         "pdf_data": [],
-        "all_board": BoardService.get_all_boards_with_orders()
+        "revision": revision,
+        "boards": boards
     }
 
     return jsonify(payload)
@@ -221,8 +259,85 @@ def clear_print_pdf():
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
-    
+
+@board_router_bp.route('/backfill_pdf_fingerprint', methods=['GET'])
+@login_required
+def backfill_pdf_fingerprint():
+    """给旧的 PrintPDF 补上 page_fingerprint；内容重复的只保留最早那条"""
+    try:
+        rows = (
+            db.session.query(PDFPageData.print_pdf_id, PDFPageData.order_item_id)
+            .join(PrintPDF, PrintPDF.id == PDFPageData.print_pdf_id)
+            .filter(PrintPDF.page_fingerprint.is_(None))
+            .order_by(PDFPageData.print_pdf_id)
+            .all()
+        )
+
+        page_items = {}
+        for pdf_id, order_item_id in rows:
+            page_items.setdefault(pdf_id, []).append(order_item_id)
+
+        taken = {
+            fp for (fp,) in db.session.query(PrintPDF.page_fingerprint)
+            .filter(PrintPDF.page_fingerprint.isnot(None))
+        }
+
+        updated = 0
+        duplicated = []
+        for pdf_id, order_item_ids in page_items.items():
+            fingerprint = PrintPDF.build_fingerprint(order_item_ids)
+            if fingerprint in taken:
+                duplicated.append(pdf_id)
+                continue
+
+            taken.add(fingerprint)
+            db.session.query(PrintPDF).filter(PrintPDF.id == pdf_id) \
+                .update({PrintPDF.page_fingerprint: fingerprint}, synchronize_session=False)
+            updated += 1
+
+        db.session.commit()
+        return jsonify({"success": True, "updated": updated, "duplicated": duplicated}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+@board_router_bp.route('/backfill_phone_digits', methods=['GET'])
+@login_required
+def backfill_phone_digits():
+    """
+    给旧订单补上 / 修正 phone_digits / phone_digits_rev
+    - 两列分别和 phone 算出来的值比较，缺的、过期的都改
+    - 一条 executemany UPDATE（Core 语句，不触发只读保护）
+    """
+    try:
+        rows = db.session.query(
+            Order.id, Order.phone, Order.phone_digits, Order.phone_digits_rev
+        ).all()
+
+        params = []
+        for order_id, phone, phone_digits, phone_digits_rev in rows:
+            digits = Order.normalize_phone(phone)
+            digits_rev = digits[::-1] if digits else None
+            if phone_digits != digits or phone_digits_rev != digits_rev:
+                params.append({"order_id": order_id, "digits": digits, "digits_rev": digits_rev})
+
+        if params:
+            orders = Order.__table__
+            db.session.execute(
+                update(orders)
+                .where(orders.c.id == bindparam("order_id"))
+                .values(phone_digits=bindparam("digits"), phone_digits_rev=bindparam("digits_rev")),
+                params,
+            )
+
+        db.session.commit()
+        return jsonify({"success": True, "updated": len(params)}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
 @board_router_bp.route('/get_all_print_data', methods=['GET'])
+@conditional_get(*PRINT_DATA_TABLES)
 def get_all_print_data():
     records = PrintPDF.query.order_by(PrintPDF.created_at.desc()).all()
     return jsonify([record.to_dict() for record in records]), 200
@@ -241,14 +356,38 @@ def get_version_list():
 @board_router_bp.route('/get_orders_data', methods=['GET'])
 @login_required
 def get_order_data():
-    # 获取 version 参数（默认为 '2024_YLP'）
-    version = request.args.get('version', '2024_YLP')  # 如果没有传 version 参数，使用默认值 '2024_YLP'
-    
-    # 获取所有指定版本的订单数据
-    orders = Order.get_order_data_by_version(version)
-    
-    # 返回 JSON 格式的订单数据
-    return jsonify(orders)
+    """
+    导出整个 version 的订单（流式）
+    GET /get_orders_data?version=2025&format=ndjson|csv
+    - 客户端 Accept-Encoding 带 gzip（或 ?gzip=1）就边压缩边传
+    """
+    version = request.args.get('version', '').strip()
+    if not version:
+        return jsonify({'status': 'error', 'message': 'version is required'}), 400
+    if version.isdigit():
+        version = int(version)
+
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format == 'csv':
+        chunks = OrderExportService.iter_csv(version)
+        mimetype = 'text/csv'
+    elif export_format == 'ndjson':
+        chunks = OrderExportService.iter_ndjson(version)
+        mimetype = 'application/x-ndjson'
+    else:
+        return jsonify({'status': 'error', 'message': f'不支持的格式: {export_format}'}), 400
+
+    headers = {
+        "Content-Disposition": f"attachment; filename=orders_{version}.{export_format}",
+        "Vary": "Accept-Encoding",
+    }
+
+    use_gzip = request.args.get('gzip') == '1' or 'gzip' in request.headers.get('Accept-Encoding', '')
+    if use_gzip:
+        chunks = OrderExportService.gzip_stream(chunks)
+        headers["Content-Encoding"] = "gzip"
+
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
 
 @board_router_bp.route('/update_customer/<int:order_id>', methods=['POST'])
 @verification_required(order_id_arg_name='order_id')
@@ -320,70 +459,22 @@ def check_duplicate_owner_fields():
 
 @board_router_bp.route('/fahui_search_emgine', methods=['POST'])
 def fahui_search_emgine():
-    from sqlalchemy import or_
-    data = request.get_json()
+    data = request.get_json() or {}
     keyword = (data.get("keyword") or "").strip().lower()
+    try:
+        limit = min(max(int(data.get("limit") or 5), 1), 20)
+    except (TypeError, ValueError):
+        limit = 5
 
     if not keyword:
         return jsonify({"success": True, "results": []})
 
-    is_number = keyword.isdigit()
-    orders = []
+    # ⚡️ 订单号 / 明细号 / 电话尾号 / 名字 / 表单字段 一条打分查询
+    # 🚨 未登录看不到 DELETE 的订单：在 SQL 里 LIMIT 之前就过滤，保证凑够 limit 条
+    is_login = bool(current_user and current_user.is_authenticated)
+    ranked = OrderSearchService.quick_search(keyword, limit=limit, include_deleted=is_login)
 
-    if is_number:
-        # ✅ 1. 先按 order_id 精确查
-        order = Order.query.filter_by(id=int(keyword)).first()
-        if order:
-            orders = [order]
-
-        # ✅ 2. 没有则按 order_item_id 查
-        if not orders:
-            order_item = OrderItem.query.filter_by(id=int(keyword)).first()
-            if order_item:
-                orders = [order_item.order]
-
-        # ✅ 3. 再按 phone 模糊查
-        if not orders:
-            orders = Order.query.filter(Order.phone.like(f"%{keyword}%")) \
-                                .order_by(Order.created_at.desc()).limit(5).all()
-
-    else:
-        # 非数字走原来的名字类模糊搜索
-        orders = Order.query.filter(
-            or_(
-                Order.customer_name.ilike(f"%{keyword}%"),
-                Order.name.ilike(f"%{keyword}%"),
-                Order.member_name.ilike(f"%{keyword}%")
-            )
-        ).order_by(Order.created_at.desc()).limit(5).all()
-
-    # ✅ 主表查不到 → 去 item 数据中查
-    if not orders:
-        matched_item_ids = db.session.query(ItemFormData.item_id) \
-            .filter(ItemFormData.field_value.ilike(f"%{keyword}%")) \
-            .limit(10).all()
-
-        item_ids = [item_id for (item_id,) in matched_item_ids]
-
-        if item_ids:
-            order_ids = db.session.query(OrderItem.order_id) \
-                .filter(OrderItem.id.in_(item_ids)).limit(10).all()
-
-            order_ids = [oid for (oid,) in order_ids]
-
-            if order_ids:
-                flat_order_ids = [oid for (oid,) in order_ids]
-                top_ids = sorted(flat_order_ids, reverse=True)[:5]
-
-                orders = Order.query.filter(Order.id.in_(top_ids)).all()
-                orders.sort(key=lambda o: top_ids.index(o.id))
-
-    # 🚨 在这里过滤掉 DELETE 且未登录的
-    results = []
-    for order in orders:
-        if order.version == "DELETE" and (not current_user or not current_user.is_authenticated):
-            continue
-        results.append(OrderService.to_dict(order))
+    results = [OrderService.to_dict(order) for order, score in ranked]
 
     return jsonify({
         "success": True,
@@ -587,7 +678,8 @@ def copy_old_data():
         member_name=old_order.member_name,
         phone=old_order.phone,
         created_at=datetime.utcnow(),
-        version=new_version
+        version=new_version,
+        source_order_id=old_order.id
     )
     db.session.add(new_order)
     db.session.flush()  # 获取 new_order.id
@@ -601,7 +693,8 @@ def copy_old_data():
             order_id=new_order.id,
             code=old_item.code,
             item_name=old_item.item_name,
-            price=old_item.price
+            price=old_item.price,
+            source_item_id=old_item.id
         )
         db.session.add(new_item)
         db.session.flush()
@@ -625,6 +718,50 @@ def copy_old_data():
     }), 201
 
 
+@board_router_bp.route('/carry_over_orders', methods=['POST'])
+@login_required
+def carry_over_orders():
+    """
+    批量续办：把旧订单（指定 id 或整个 version）复制到新 version
+    body: {"target_version": "2025_YLP", "order_ids": [...]} 或 {"target_version": ..., "source_version": 2024}
+    返回 NDJSON 进度流，每块一行，最后一行 status=done
+    """
+    data = request.get_json() or {}
+    target_version = data.get('target_version') or '2025_YLP'
+    order_ids = data.get('order_ids')
+    source_version = data.get('source_version')
+
+    try:
+        chunk_size = int(data.get('chunk_size') or OrderCarryOverService.CHUNK_SIZE)
+    except (ValueError, TypeError):
+        return jsonify({"error": "chunk_size 必须是整数"}), 400
+    chunk_size = min(max(chunk_size, 1), 1000)
+
+    try:
+        if order_ids is not None:
+            order_ids = [int(oid) for oid in order_ids]
+        progress = OrderCarryOverService.carry_over(
+            target_version,
+            order_ids=order_ids,
+            source_version=source_version,
+            chunk_size=chunk_size,
+        )
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    def generate():
+        last = {"done": 0, "total": 0, "copied": 0, "skipped": 0}
+        try:
+            for last in progress:
+                yield json.dumps({"status": "running", **last}) + "\n"
+        except Exception as e:
+            yield json.dumps({"status": "error", "message": str(e), **last}) + "\n"
+            return
+        yield json.dumps({"status": "done", **last}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
 @board_router_bp.route('/update_item_form_value', methods=['POST'])
 def update_item_form_value():
     data = request.get_json()
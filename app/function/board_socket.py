@@ -0,0 +1,70 @@
+# board_socket.py
+from flask import current_app
+from flask_socketio import Namespace, join_room, leave_room, emit
+
+from app.extensions import socketio
+
+
+class BoardNamespace(Namespace):
+    """
+    牌位板实时推送（namespace: /board）
+    - 每块板一个房间 board:<board_id>；大厅总览订阅 board:all
+    - 客户端: socket.emit("subscribe", {board_id: 3}) / {board_id: "all"}
+    """
+
+    NAMESPACE = "/board"
+    ALL_ROOM = "board:all"
+
+    @staticmethod
+    def room_for(board_id) -> str:
+        return f"board:{board_id}"
+
+    def on_connect(self):
+        emit("connected", {"namespace": self.NAMESPACE})
+
+    def on_subscribe(self, data):
+        room = self._room_from(data)
+        if not room:
+            emit("error", {"message": "board_id is required"})
+            return
+        join_room(room)
+        emit("subscribed", {"room": room})
+
+    def on_unsubscribe(self, data):
+        room = self._room_from(data)
+        if room:
+            leave_room(room)
+            emit("unsubscribed", {"room": room})
+
+    @staticmethod
+    def _room_from(data):
+        board_id = (data or {}).get("board_id")
+        if board_id in (None, ""):
+            return None
+        if board_id == "all":
+            return BoardNamespace.ALL_ROOM
+        try:
+            return BoardNamespace.room_for(int(board_id))
+        except (TypeError, ValueError):
+            return None
+
+
+def broadcast_slot_change(action: str, revision: int, boards: list, **slot):
+    """
+    提交成功后调用：把改动推给该板的房间 + 总览房间
+    action: add / move / delete；slot: side_id / print_pdf_id / location 等
+    - 推送失败（Redis 不在等）只记日志，不影响已经提交的改动
+    """
+    for board in boards:
+        payload = {
+            "action": action,
+            "revision": revision,
+            "board_id": board["board_id"],
+            "board": board,
+            **slot,
+        }
+        rooms = [BoardNamespace.room_for(board["board_id"]), BoardNamespace.ALL_ROOM]
+        try:
+            socketio.emit("slot_changed", payload, namespace=BoardNamespace.NAMESPACE, to=rooms)
+        except Exception as e:
+            current_app.logger.warning(f"board socket 推送失败: {e}")
@@ -29,6 +29,16 @@ def unauthorized():
 
 READ_ONLY_ORDER_VERSIONS = {"YLP_2024", "YLP_2025"}
 
+# 牌位并行渲染：进程池大小 / 大分组按多少页切一块
+PAIWEI_RENDER_WORKERS = os.cpu_count() or 1
+PAIWEI_PAGES_PER_CHUNK = 50
+
+# 牌位缩略图缓存（paiweicache）磁盘上限，超出按 LRU 淘汰
+PAIWEI_THUMB_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# 缩略图预热时同时在渲染的页数上限
+PAIWEI_THUMB_WARM_CONCURRENCY = PAIWEI_RENDER_WORKERS
+
 # 用户加载回调
 @login_manager.user_loader
 def load_user(user_id):
@@ -2,12 +2,14 @@ from datetime import datetime
 from flask import send_file, current_app, Blueprint, jsonify,request
 from flask_login import login_required,current_user
 from app.models.fahui import Order,ItemFormData,OrderItem,PrintPDF,PDFPageData,BoardData,BoardHeader
+from app.models.order_search import OrderSearchGram
 from app.extensions import db
 from app.function.config import verification_required
 from sqlalchemy import text
 
 from app.services.order_service import OrderService
 from app.services.board_service import BoardService
+from app.services.order_nav_service import OrderNavService
 
 fahui_router_bp = Blueprint('fahui_router', __name__)
 
@@ -41,6 +43,102 @@ def search():
         "data": result
     })
 
+@fahui_router_bp.route("/search_cursor", methods=["GET"])
+def search_cursor():
+    """
+    游标分页版 /search：深翻页也是固定成本
+    GET /search_cursor?version=2025&value=陈&limit=20&cursor=<token>&total=1
+    """
+
+    # ===== 参数读取 =====
+    version = request.args.get("version", type=int)
+    value = request.args.get("value", default="", type=str)
+    cursor = request.args.get("cursor", default=None, type=str)
+    limit = min(request.args.get("limit", default=20, type=int), 100)
+    with_total = request.args.get("total", default="0") in ("1", "true", "yes")
+
+    # ===== 基础参数校验 =====
+    if version is None:
+        return jsonify({
+            "status": "error",
+            "message": "version is required"
+        }), 400
+
+    # ===== 调用 Service =====
+    try:
+        result = OrderService.search_orders_cursor(
+            version=version,
+            value=value,
+            cursor=cursor or None,
+            limit=limit,
+            with_total=with_total
+        )
+    except ValueError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
+
+    # ===== 返回统一结构 =====
+    return jsonify({
+        "status": "success",
+        "data": result
+    })
+
+@fahui_router_bp.route("/order_neighbors", methods=["GET"])
+@login_required
+def order_neighbors():
+    """
+    上一单 / 下一单：限定 version（默认用订单自己的），可再加搜索关键字
+    GET /order_neighbors?order_id=123&version=2025&value=陈
+    """
+    order_id = request.args.get("order_id", type=int)
+    value = request.args.get("value", default="", type=str)
+
+    if not order_id:
+        return jsonify({
+            "status": "error",
+            "message": "order_id is required"
+        }), 400
+
+    version = request.args.get("version", type=int)
+    if version is None:
+        version = db.session.query(Order.version).filter(Order.id == order_id).scalar()
+        if version is None:
+            return jsonify({
+                "status": "error",
+                "message": f"找不到订单 ID {order_id}"
+            }), 404
+
+    prev_id, next_id = OrderNavService.neighbors(order_id, version, value)
+
+    return jsonify({
+        "status": "success",
+        "data": {
+            "order_id": order_id,
+            "version": version,
+            "prev_id": prev_id,
+            "next_id": next_id,
+        }
+    })
+
+@fahui_router_bp.route("/rebuild_search_index", methods=["POST"])
+@login_required
+def rebuild_search_index():
+    """全量重建订单搜索 n-gram 索引（建表后 / 数据修复时跑一次）"""
+    try:
+        total = OrderSearchGram.rebuild_all()
+        return jsonify({
+            "status": "success",
+            "data": {"orders": total}
+        })
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
 @fahui_router_bp.route("/get_order_by_id", methods=["GET"])
 def get_order_by_id():
     # ===== 参数读取 =====
@@ -1,13 +1,18 @@
 from datetime import datetime
-from flask import send_from_directory,send_file, Response,current_app, Blueprint, jsonify,request,render_template
+from flask import send_from_directory,send_file, Response,current_app, Blueprint, jsonify,request,render_template,stream_with_context
 from flask_login import login_required
-from app.models.fahui import Order,ItemFormData,OrderItem,PrintPDF,PDFPageData
+from app.models.fahui import Order,ItemFormData,OrderItem,PrintPDF,PDFPageData,BoardData
 from app.extensions import db
+from sqlalchemy.exc import IntegrityError
 import os
-from app.function.config import data_path
+from app.function.config import data_path, PAIWEI_RENDER_WORKERS, PAIWEI_PAGES_PER_CHUNK, PAIWEI_THUMB_WARM_CONCURRENCY
 from werkzeug.utils import secure_filename
 import re
 from app.services.order_item_service import OrderItemService
+from app.services.paiwei_layout_service import PaiweiLayoutService
+from app.services.paiwei_thumbnail_service import PaiweiThumbnailService
+from app.services.print_job_service import PrintJobService
+from sqlalchemy.orm import selectinload
 
 print_paiwei_bp = Blueprint('print_paiwei', __name__)
 
@@ -114,26 +119,177 @@ def print_paiwei_order_item(print_pdf_id):
 
     order_item_ids = [pd.order_item_id for pd in page_data]
 
+    try:
+        cache_file = get_paiwei_thumbnail(print_pdf_id, order_item_ids)
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
 
-    buffer = generate_paiwei_using_order_item_ids(order_item_ids)
+    if not cache_file:
+        return jsonify({"status": "error", "message": "PDF 转换失败"}), 500
 
-    # ✅ 6. 缓存目录
-    cache_dir = os.path.join(data_path, "paiwei_result", "paiweicache")
-    os.makedirs(cache_dir, exist_ok=True)
-    cache_file = os.path.join(cache_dir, f"{print_pdf_id}.jpeg")
+    # ✅ 3. 返回图片
+    return send_file(cache_file, mimetype="image/jpeg")
 
-    if not os.path.exists(cache_file):
-        try:
-            images = convert_from_bytes(buffer.getvalue(), first_page=1, last_page=1, fmt='jpeg')
-            if not images:
-                return jsonify({"status": "error", "message": "PDF 转换失败"}), 500
+def get_paiwei_thumbnail(print_pdf_id, order_item_ids):
+    """
+    先查缓存再渲染：
+    - key 是这一页打印内容 + 模板签名的哈希，ItemFormData 改了 key 就变
+    - 命中直接返回 jpeg 路径，没命中才生成 PDF + pdf2image
+    """
+    items = (
+        OrderItem.query
+        .options(selectinload(OrderItem.item_form_data))
+        .filter(OrderItem.id.in_(order_item_ids))
+        .all()
+    )
+    filtered_data = filter_fahui_data(items)
+    if not filtered_data:
+        return None
 
-            images[0].save(cache_file, "JPEG")
-        except Exception as e:
-            return jsonify({"status": "error", "message": str(e)}), 500
+    key = PaiweiThumbnailService.content_key(filtered_data)
+    cache_file = PaiweiThumbnailService.get(print_pdf_id, key)
+    if cache_file:
+        return cache_file
 
-    # ✅ 7. 返回图片
-    return send_file(cache_file, mimetype="image/jpeg")
+    data = render_thumbnail_bytes(filtered_data)
+    if not data:
+        return None
+
+    return PaiweiThumbnailService.put_bytes(print_pdf_id, key, data)
+
+def render_thumbnail_bytes(filtered_data):
+    """渲染第一页并转成 jpeg bytes；不访问数据库，可以在子进程里跑"""
+    buffer = generate_paiwei_using_print_data(filtered_data)
+    images = convert_from_bytes(buffer.getvalue(), first_page=1, last_page=1, fmt='jpeg')
+    if not images:
+        return None
+
+    output = BytesIO()
+    images[0].save(output, "JPEG")
+    return output.getvalue()
+
+def collect_thumbnail_print_data(board_id=None):
+    """
+    取出要预热的 PrintPDF 的打印数据：{print_pdf_id: filtered_data}
+    - board_id 为空：全部 PrintPDF
+    - 否则只取挂在该 BoardHeader 上的
+    """
+    query = db.session.query(PDFPageData.print_pdf_id, PDFPageData.order_item_id)
+    if board_id is not None:
+        query = (
+            query.join(BoardData, BoardData.print_pdf_id == PDFPageData.print_pdf_id)
+            .filter(BoardData.board_id == board_id)
+        )
+
+    page_items = {}
+    for print_pdf_id, order_item_id in query.all():
+        page_items.setdefault(print_pdf_id, []).append(order_item_id)
+
+    if not page_items:
+        return {}
+
+    # 一次性把所有 OrderItem + ItemFormData 拿出来
+    all_item_ids = {oid for ids in page_items.values() for oid in ids}
+    items = (
+        OrderItem.query
+        .options(selectinload(OrderItem.item_form_data))
+        .filter(OrderItem.id.in_(all_item_ids))
+        .all()
+    )
+    items_by_id = {item.id: item for item in items}
+
+    result = {}
+    for print_pdf_id, ids in page_items.items():
+        page_items_list = [items_by_id[oid] for oid in ids if oid in items_by_id]
+        filtered_data = filter_fahui_data(page_items_list)
+        if filtered_data:
+            result[print_pdf_id] = filtered_data
+    return result
+
+def warm_paiwei_thumbnails(board_id=None, concurrency=PAIWEI_THUMB_WARM_CONCURRENCY):
+    """
+    预热缩略图：缓存里没有的才渲染，丢进渲染进程池并行跑
+    - 同时在跑的页数不超过 concurrency
+    返回 {"total", "cached", "rendered", "failed"}
+    """
+    print_data = collect_thumbnail_print_data(board_id)
+
+    missing = []
+    for print_pdf_id, filtered_data in print_data.items():
+        key = PaiweiThumbnailService.content_key(filtered_data)
+        if not PaiweiThumbnailService.get(print_pdf_id, key):
+            missing.append((print_pdf_id, key, filtered_data))
+
+    stats = {
+        "total": len(print_data),
+        "cached": len(print_data) - len(missing),
+        "rendered": 0,
+        "failed": [],
+    }
+    if not missing:
+        return stats
+
+    pool = get_render_pool()
+    concurrency = max(1, concurrency)
+    in_flight = {}
+    todo = iter(missing)
+
+    def submit_next():
+        job = next(todo, None)
+        if job is None:
+            return False
+        print_pdf_id, key, filtered_data = job
+        future = pool.submit(render_thumbnail_bytes, filtered_data)
+        in_flight[future] = (print_pdf_id, key)
+        return True
+
+    try:
+        while len(in_flight) < concurrency and submit_next():
+            pass
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                print_pdf_id, key = in_flight.pop(future)
+                try:
+                    data = future.result()
+                except BrokenProcessPool:
+                    raise
+                except Exception as e:
+                    print(f"⚠️ 缩略图 {print_pdf_id} 生成失败: {e}", flush=True)
+                    data = None
+
+                if data:
+                    PaiweiThumbnailService.put_bytes(print_pdf_id, key, data)
+                    stats["rendered"] += 1
+                else:
+                    stats["failed"].append(print_pdf_id)
+
+                submit_next()
+    except BrokenProcessPool:
+        reset_render_pool()
+        raise
+
+    return stats
+
+@print_paiwei_bp.route('/warm_thumbnails', methods=['POST'])
+@login_required
+def warm_thumbnails():
+    """预热缩略图；body 可带 board_id 只预热某一块牌位板"""
+    data = request.get_json(silent=True) or {}
+    board_id = data.get("board_id")
+
+    try:
+        board_id = int(board_id) if board_id not in (None, "") else None
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'board_id 必须是整数'}), 400
+
+    try:
+        stats = warm_paiwei_thumbnails(board_id=board_id)
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+    return jsonify({'status': 'success', **stats})
 
 from PyPDF2 import PdfMerger
 import random
@@ -214,7 +370,7 @@ def filter_fahui_data(items):
     return filtered_data
 
 
-def generate_paiwei_using_order_item_ids(order_item_ids, need_barcode=False):
+def generate_paiwei_using_order_item_ids(order_item_ids, need_barcode=False, save_copy=False, parallel=False):
     # 1. 查询 OrderItem
     items = OrderItem.query.filter(OrderItem.id.in_(order_item_ids)).all()
     if not items:
@@ -225,19 +381,29 @@ def generate_paiwei_using_order_item_ids(order_item_ids, need_barcode=False):
     if not filtered_data:
         return None
 
+    return generate_paiwei_using_print_data(
+        filtered_data, need_barcode=need_barcode, save_copy=save_copy, parallel=parallel
+    )
+
+def generate_paiwei_using_print_data(filtered_data, need_barcode=False, save_copy=False, parallel=False):
+    """filtered_data: filter_fahui_data 的结果，按 code 分组渲染后合并成一个 PDF"""
     # 3. 按 code 分组
     grouped_data = {}
     for item in filtered_data:
         grouped_data.setdefault(item.get("code"), []).append(item)
 
     # 4. 循环生成多个 buffer
-    merger = PdfMerger()
+    groups = []
     for code, items in grouped_data.items():
         point_data, source_name = get_point_data(code)
         if not point_data:
             continue  # 跳过异常 code
+        groups.append((code, items, point_data, source_name))
 
-        buffer = generate_paiwei(code, items, point_data, source_name, need_barcode=need_barcode)
+    merger = PdfMerger()
+    for code, buffer in render_paiwei_groups(
+        groups, need_barcode=need_barcode, save_copy=save_copy, parallel=parallel
+    ):
         buffer.seek(0)
         merger.append(buffer)
 
@@ -250,31 +416,55 @@ def generate_paiwei_using_order_item_ids(order_item_ids, need_barcode=False):
 
 import zipfile
 
-def generate_paiwei_using_order_ids(order_ids, need_barcode=False):
+def build_order_paiwei_groups(order_ids):
+    """
+    按订单取出要打印的 OrderItem，按 code 分组
+    返回 (groups, error_message)，groups: [(code, items, point_data, source_name), ...]
+    """
     # 1. 拿 OrderItem
     items = OrderItem.query.join(Order).filter(Order.id.in_(order_ids)).all()
     if not items:
-        return jsonify({'status': 'error', 'message': '没有找到对应的订单数据'}), 400
+        return None, '没有找到对应的订单数据'
 
     # 2. 转换
     filtered_data = filter_fahui_data(items)
     if not filtered_data:
-        return jsonify({'status': 'error', 'message': '没有有效的法会数据'}), 400
+        return None, '没有有效的法会数据'
 
     # 3. 按 code 分组
     grouped_data = {}
     for item in filtered_data:
         grouped_data.setdefault(item.get('code'), []).append(item)
 
-    # 4. 循环生成 pdf
-    buffers = []
+    groups = []
     for code, items in grouped_data.items():
         point_data, source_name = get_point_data(code)
         if not point_data:
-            return jsonify({'status': 'error', 'message': f'⚠️ 找不到 point_data 对应 code: {code}'}), 400
+            return None, f'⚠️ 找不到 point_data 对应 code: {code}'
+        groups.append((code, items, point_data, source_name))
 
-        buffer = generate_paiwei(code, items, point_data, source_name, need_barcode=need_barcode)
-        buffers.append((code, buffer))
+    return groups, None
+
+def generate_paiwei_using_order_ids(order_ids, need_barcode=False, save_copy=False, parallel=False, stream=False):
+    # 1~3. 取数据并分组
+    groups, error = build_order_paiwei_groups(order_ids)
+    if error:
+        return jsonify({'status': 'error', 'message': error}), 400
+
+    # 4. 循环生成 pdf
+    # ⚡️ 流式模式：每个 code 渲染完就压缩并推给前端，内存只占一个分组
+    if stream:
+        return Response(
+            stream_with_context(stream_paiwei_zip(
+                groups, need_barcode=need_barcode, save_copy=save_copy, parallel=parallel
+            )),
+            mimetype="application/zip",
+            headers={"Content-Disposition": "attachment; filename=paiwei_files.zip"}
+        )
+
+    buffers = render_paiwei_groups(
+        groups, need_barcode=need_barcode, save_copy=save_copy, parallel=parallel
+    )
 
     # 5. 打包 zip
     zip_buffer = io.BytesIO()
@@ -292,6 +482,58 @@ def generate_paiwei_using_order_ids(order_ids, need_barcode=False):
         download_name="paiwei_files.zip"
     )
 
+ZIP_STREAM_CHUNK_SIZE = 64 * 1024
+
+class ZipStreamBuffer:
+    """zipfile 的写入目标：只支持 write / tell，写进来的数据由生成器取走后清空"""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def stream_paiwei_zip(groups, need_barcode=False, save_copy=False, parallel=False, progress=None):
+    """逐个 code 渲染、压缩并 yield 出去，不在内存里攒整个 zip"""
+    sink = ZipStreamBuffer()
+
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as zipf:
+        for code, buffer in iter_paiwei_groups(
+            groups, need_barcode=need_barcode, save_copy=save_copy,
+            parallel=parallel, progress=progress, max_groups_in_flight=1
+        ):
+            buffer.seek(0)
+            with zipf.open(f"paiwei_{code}.pdf", "w") as dest:
+                for piece in iter(lambda: buffer.read(ZIP_STREAM_CHUNK_SIZE), b''):
+                    dest.write(piece)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            buffer.close()
+
+            data = sink.drain()
+            if data:
+                yield data
+
+    # 中央目录在 ZipFile 关闭时才写出
+    data = sink.drain()
+    if data:
+        yield data
+
 import io
 
 @print_paiwei_bp.route("/generate_by_orders", methods=["POST"])
@@ -299,9 +541,99 @@ def generate_by_orders():
     data = request.get_json()
     order_ids = data.get("order_ids", [])
     need_barcode = data.get("need_barcode", False)
-    return generate_paiwei_using_order_ids(order_ids, need_barcode=need_barcode)
+    save_copy = data.get("save_copy", False)  # 需要存档到 paiwei_result/ 时才传 true
+    parallel = data.get("parallel", False)    # 整场法会大批量打印时用多进程渲染
+    stream = data.get("stream", False)        # 流式 zip：没有 Content-Length，但内存只占一个分组
+    return generate_paiwei_using_order_ids(
+        order_ids, need_barcode=need_barcode, save_copy=save_copy,
+        parallel=parallel, stream=stream
+    )
+
+
+
+# ========= 后台打印任务 =========
+
+@print_paiwei_bp.route("/jobs", methods=["POST"])
+def create_print_job():
+    """参数同 /generate_by_orders，立即返回 job_id，由 run_print_worker.py 在后台渲染"""
+    data = request.get_json() or {}
+    order_ids = data.get("order_ids", [])
+    if not order_ids:
+        return jsonify({'status': 'error', 'message': '缺少 order_ids'}), 400
+
+    job_id = PrintJobService.enqueue({
+        "order_ids": order_ids,
+        "need_barcode": bool(data.get("need_barcode", False)),
+        "save_copy": bool(data.get("save_copy", False)),
+        "parallel": bool(data.get("parallel", False)),
+    })
+    return jsonify({'status': 'success', 'job_id': job_id}), 202
+
+@print_paiwei_bp.route("/jobs/<job_id>", methods=["GET"])
+def get_print_job(job_id):
+    job = PrintJobService.get(job_id)
+    if not job:
+        return jsonify({'status': 'error', 'message': f'任务 {job_id} 不存在或已过期'}), 404
+
+    job.pop("params", None)
+    return jsonify({'status': 'success', 'job': job})
+
+@print_paiwei_bp.route("/jobs/<job_id>/download", methods=["GET"])
+def download_print_job(job_id):
+    job = PrintJobService.get(job_id)
+    if not job:
+        return jsonify({'status': 'error', 'message': f'任务 {job_id} 不存在或已过期'}), 404
+
+    if job["status"] != PrintJobService.STATUS_DONE:
+        return jsonify({'status': 'error', 'message': f'任务尚未完成：{job["status"]}'}), 409
+
+    artifact = PrintJobService.artifact_path(job_id)
+    if not os.path.exists(artifact):
+        return jsonify({'status': 'error', 'message': '文件已被清理'}), 410
+
+    return send_file(
+        artifact,
+        mimetype="application/zip",
+        as_attachment=True,
+        download_name="paiwei_files.zip"
+    )
 
+def run_print_job(job_id):
+    """worker 进程里执行一个打印任务：渲染成 zip 落盘，进度写回 Redis"""
+    job = PrintJobService.get(job_id)
+    if not job:
+        return
 
+    params = job["params"]
+    try:
+        groups, error = build_order_paiwei_groups(params.get("order_ids", []))
+        if error:
+            PrintJobService.fail(job_id, error)
+            return
+
+        total_pages = sum(
+            count_paiwei_pages(items, point_data)
+            for _, items, point_data, _ in groups
+        )
+        PrintJobService.start(job_id, total_pages)
+
+        artifact = PrintJobService.artifact_path(job_id)
+        tmp_path = f"{artifact}.tmp"
+        with open(tmp_path, "wb") as f:
+            for data in stream_paiwei_zip(
+                groups,
+                need_barcode=params.get("need_barcode", False),
+                save_copy=params.get("save_copy", False),
+                parallel=params.get("parallel", False),
+                progress=lambda pages: PrintJobService.add_progress(job_id, pages),
+            ):
+                f.write(data)
+        os.replace(tmp_path, artifact)
+
+        PrintJobService.finish(job_id)
+    except Exception as e:
+        db.session.rollback()
+        PrintJobService.fail(job_id, str(e))
 
 @print_paiwei_bp.route('/download/<filename>', methods=['GET'])
 @login_required
@@ -313,31 +645,8 @@ def download_file(filename):
     return send_from_directory(directory, filename, as_attachment=False)
 
 def get_point_data(paiwei_type):
-    # 根据牌位类型选择模板名
-    if paiwei_type in ('A1', 'A2', 'A3'):
-        souce_name = 'paiwei_1'
-    elif paiwei_type in ('B1', 'B2', 'B3'):
-        souce_name = 'paiwei_5'
-    elif paiwei_type == 'C':
-        souce_name = 'paiwei_10'
-    else:
-        return None, None  # 或 raise ValueError("Invalid type")
-
-    # JSON 文件路径
-    json_file_path = os.path.join(data_path, 'point.json')
-
-    # 加载 JSON 数据
-    with open(json_file_path, 'r', encoding='utf-8') as f:
-        point_data = json.load(f)
-
-    # 查找对应 souce_name 的内容
-    for entry in point_data:
-        if souce_name in entry:
-            result = entry[souce_name]
-            return result, souce_name
-
-    # 如果没找到
-    return None, souce_name
+    # 点位数据走进程内缓存，point.json 变化才重新读取
+    return PaiweiLayoutService.get_point_data(paiwei_type)
 
 
 from reportlab.lib.pagesizes import A4, landscape
@@ -351,23 +660,39 @@ from reportlab.lib import colors
 from reportlab.graphics.barcode import code128
 from io import BytesIO
 from pdfrw import PdfReader, PdfWriter, PageMerge
+from pdfrw.buildxobj import pagexobj, ViewInfo
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque
 import qrcode
-from reportlab.lib.utils import ImageReader
+from functools import lru_cache
 
 def get_owner_point(owner_point):
-    json_file_path = os.path.join(data_path, f'{owner_point}.json')
-    with open(json_file_path, 'r', encoding='utf-8') as f:
-        owner_point = json.load(f)
-    return owner_point
+    return PaiweiLayoutService.load_json(owner_point)
 
 def get_deceased_point(file_key):
-    json_file_path = os.path.join(data_path, f'{file_key}.json')
-    with open(json_file_path, 'r', encoding='utf-8') as f:
-        deceased_point = json.load(f)
-    return deceased_point
+    return PaiweiLayoutService.load_json(file_key)
 
-def generate_paiwei(paiwei_type,fahui_data, point_data, souce_name,need_barcode=False):
+def generate_paiwei(paiwei_type,fahui_data, point_data, souce_name,need_barcode=False,save_copy=False,progress=None):
     print(fahui_data)
+    fahui_data = prepare_fahui_data(paiwei_type, fahui_data)
+
+    # 条码需要写数据库，先在当前进程里分配好，渲染本身不碰数据库
+    page_barcodes = None
+    if need_barcode:
+        page_barcodes = assign_page_barcodes(fahui_data, point_data, souce_name)
+
+    buffer = render_paiwei(paiwei_type, fahui_data, point_data, souce_name, page_barcodes, progress)
+
+    # ⚡️ 需要存档时才写入磁盘
+    if save_copy:
+        save_paiwei_copy(buffer, f'{souce_name}_{paiwei_type}_output.pdf')
+
+    return buffer
+
+def prepare_fahui_data(paiwei_type, fahui_data):
     # 处理 A3 或 B3 的特殊逻辑
     if paiwei_type in ['A3', 'B3']:
         for item in fahui_data:
@@ -390,41 +715,121 @@ def generate_paiwei(paiwei_type,fahui_data, point_data, souce_name,need_barcode=
                 form_data['owner'] = owner_list
 
             item['item_form_data'] = form_data
-    # 打印处理后的数据，方便验证
+    return fahui_data
 
-    buffer = BytesIO()
-    output_path = os.path.join(data_path, 'paiwei_result')
-    os.makedirs(output_path, exist_ok=True)
+def get_page_size(souce_name):
+    # 判断页面方向：paiwei_5 横向，其余纵向
+    if souce_name == 'paiwei_5':
+        return landscape(A4)
+    return A4
 
+def get_point_positions(point_data):
+    """整理点位，返回 (point_dict, positions)，positions 排序如 ['A', 'B', 'C', ...]"""
+    point_dict = {}
+    for block in point_data:
+        point_dict.update(block)
+    return point_dict, sorted(point_dict.keys())
+
+def iter_paiwei_pages(fahui_data, point_data):
+    """
+    按模板位置数切页，yield (page_start, page_order_item_ids)
+    - 和绘制逻辑一致：这一页所有位置都没有 center_point 的话跳过
+    """
+    point_dict, positions = get_point_positions(point_data)
+    items_per_page = len(positions)
+
+    for page_start in range(0, len(fahui_data), items_per_page):
+        page_items = fahui_data[page_start:page_start + items_per_page]
+        has_center = any(
+            'center_point' in pt
+            for pos in positions[:len(page_items)]
+            for pt in point_dict.get(pos, [])
+        )
+        if has_center:
+            yield page_start, [item['id'] for item in page_items]
+
+def count_paiwei_pages(fahui_data, point_data):
+    return sum(1 for _ in iter_paiwei_pages(fahui_data, point_data))
+
+def assign_page_barcodes(fahui_data, point_data, souce_name, retries=1):
+    """
+    为每一页找到 / 创建对应的 PrintPDF，返回 {page_start: print_pdf_id}
+    - 按页面指纹一次 IN 查询找出已存在的
+    - 缺的 PrintPDF + PDFPageData 一次 flush 批量写入
+    """
+    width, height = get_page_size(souce_name)
+
+    page_fingerprints = {}
+    page_item_ids = {}
+    for page_start, page_order_item_ids in iter_paiwei_pages(fahui_data, point_data):
+        page_fingerprints[page_start] = PrintPDF.build_fingerprint(page_order_item_ids)
+        page_item_ids[page_start] = page_order_item_ids
+
+    if not page_fingerprints:
+        return {}
+
+    try:
+        # ⚡️ 先查已存在的 PrintPDF（唯一索引）
+        existing = dict(
+            db.session.query(PrintPDF.page_fingerprint, PrintPDF.id)
+            .filter(PrintPDF.page_fingerprint.in_(set(page_fingerprints.values())))
+            .all()
+        )
+
+        # ✅ 创建缺少的 PrintPDF，同一任务里重复的页面只建一次
+        new_pdfs = {}
+        for page_start, fingerprint in page_fingerprints.items():
+            if fingerprint in existing or fingerprint in new_pdfs:
+                continue
+
+            new_pdf = PrintPDF(width=width, height=height, page_fingerprint=fingerprint)
+            new_pdf.page_data = [
+                PDFPageData(order_item_id=oid)
+                for oid in dict.fromkeys(page_item_ids[page_start])
+            ]
+            new_pdfs[fingerprint] = new_pdf
+
+        if new_pdfs:
+            db.session.add_all(new_pdfs.values())
+            db.session.flush()
+            existing.update({fp: pdf.id for fp, pdf in new_pdfs.items()})
+
+        db.session.commit()  # 提交数据库更改，保存 PrintPDF 和 PDFPageData 记录
+    except IntegrityError:
+        # 并发任务刚好建了同一个指纹：回滚后重新查一次
+        db.session.rollback()
+        if retries <= 0:
+            raise
+        return assign_page_barcodes(fahui_data, point_data, souce_name, retries=retries - 1)
+
+    return {
+        page_start: existing[fingerprint]
+        for page_start, fingerprint in page_fingerprints.items()
+    }
+
+def render_paiwei(paiwei_type, fahui_data, point_data, souce_name, page_barcodes=None, progress=None):
+    """
+    纯渲染：只依赖传入的 dict 数据，不访问数据库，可以在子进程里跑
+    - page_barcodes: {page_start: barcode_id}，None 表示不打条码
+    - progress: 每画完一页调用 progress(1)
+    """
     file_name = f'{souce_name}.pdf'
     bg_pdf_path = os.path.join(data_path, 'paiwei_template', file_name)
 
-    # 注册字体
-    font_path = os.path.join(data_path, 'kai.ttf')
-    pdfmetrics.registerFont(TTFont('TW-Kai', font_path))
-    # 判断页面方向
-    if souce_name == 'paiwei_5':
-        page_size = landscape(A4)  # 横向 A4
-        owner_point = get_owner_point('owner_point_B')
-        deceased_point = get_deceased_point('deceased_point_B')
-    elif souce_name == 'paiwei_1':
-        page_size = A4  # 纵向 A4
-        owner_point = get_owner_point('owner_point_A')
-        deceased_point = get_deceased_point('deceased_point_A')
-    else:
-        page_size = A4  # 纵向 A4
-        owner_point = get_owner_point('owner_point_C')
-        deceased_point = get_deceased_point('deceased_point_C')
+    # 注册字体（每个 worker 只解析一次 kai.ttf）
+    PaiweiLayoutService.register_font()
+    page_size = get_page_size(souce_name)
+    owner_point = PaiweiLayoutService.get_owner_point(souce_name)
+    deceased_point = PaiweiLayoutService.get_deceased_point(souce_name)
 
 
-    temp_pdf_path = os.path.join(output_path, f'{souce_name}_temp_text_{paiwei_type}.pdf')
-    c = canvas.Canvas(temp_pdf_path, pagesize=page_size)
+    # ⚡️ 文字层直接画进内存，不再落地临时文件（并发任务互不覆盖）
+    overlay_buffer = BytesIO()
+    c = canvas.Canvas(overlay_buffer, pagesize=page_size)
     width, height = page_size  # 更新宽高变量
 
     # 整理点位
-    point_dict = {}
-    for block in point_data:
-        point_dict.update(block)
+    point_dict, positions = get_point_positions(point_data)
 
     def get_point(block_key, key):
         for pt in point_dict.get(block_key, []):
@@ -432,8 +837,6 @@ def generate_paiwei(paiwei_type,fahui_data, point_data, souce_name,need_barcode=
                 return pt[f"{key}_point"]
         return None
 
-    positions = sorted(point_dict.keys())  # 排序如 ['A', 'B', 'C', ...]
-
 
     def draw_text_vertical(block_key, key, text, base_x, base_y):
         pt = get_point(block_key, key)
@@ -617,97 +1020,266 @@ def generate_paiwei(paiwei_type,fahui_data, point_data, souce_name,need_barcode=
                 draw_text_vertical(pos, 'deceased', info.get('deceased', ''), base_x, base_y)
          
         if drew_on_page:
-            
-            if need_barcode:
-                # ⚡️ 先检查是否已有对应的 PrintPDF
-                existing_pdf = None
-                # 找到所有包含这些 order_item_id 的 pdf 记录
-                candidate_pdfs = (
-                    db.session.query(PrintPDF)
-                    .join(PDFPageData)
-                    .filter(PDFPageData.order_item_id.in_(page_order_item_ids))
-                    .all()
-                )
-
-                for pdf in candidate_pdfs:
-                    existing_ids = {pd.order_item_id for pd in pdf.page_data}
-                    if existing_ids == set(page_order_item_ids):  # ⚡️ 完全一致
-                        existing_pdf = pdf
-                        break
-
-                if existing_pdf:
-                    new_pdf = existing_pdf
-                    barcode_id = new_pdf.id
-                else:
-                    # ✅ 创建新的 PrintPDF
-                    new_pdf = PrintPDF(width=width, height=height)
-                    db.session.add(new_pdf)
-                    db.session.flush()
-
-                    # 新建 page_data
-                    for oid in page_order_item_ids:
-                        new_page_data = PDFPageData(print_pdf_id=new_pdf.id, order_item_id=oid)
-                        db.session.add(new_page_data)
-
-                    barcode_id = new_pdf.id
-
-                # ⚡️ 判断页面横纵向，计算位置
-                if width > height:  # 横向
-                    barcode_x, barcode_y = 0, 0
-                else:  # 纵向
-                    barcode_x, barcode_y = 0, 0
-
-                buf = io.BytesIO()
-                img = qrcode.make(str(barcode_id))
-                img.save(buf, format="PNG")
-                buf.seek(0)
-                qr_img = ImageReader(buf)
-                c.drawImage(qr_img, barcode_x +5, barcode_y +5, width=50, height=50)
-                # 条形码上方加文字（打印数字 ID）
-                c.setFont("TW-Kai", 10)
-                c.setFillColor(colors.black)
-                c.drawString(barcode_x + 22, barcode_y + 50, str(barcode_id))
+
+            if page_barcodes is not None and page_start in page_barcodes:
+                draw_page_barcode(c, page_barcodes[page_start], width, height)
 
             c.showPage()
 
             page_number += 1
-        db.session.commit()  # 提交数据库更改，保存 PrintPDF 和 PDFPageData 记录
+            if progress:
+                progress(1)
     c.save()
 
-    final_file_name = f'{souce_name}_{paiwei_type}_output.pdf'
-    final_pdf_path = os.path.join(output_path, final_file_name)
-
-    overlay_pdf = PdfReader(temp_pdf_path)
+    overlay_pdf = PdfReader(fdata=overlay_buffer.getvalue())
     writer = PdfWriter()
 
-    buffer = BytesIO()
+    # ⚡️ 模板整个任务只解析一次，做成 Form XObject 每页复用（输出文件里也只存一份）
+    bg_page, bg_xobj = load_template_xobj(bg_pdf_path)
+    bg_inheritable = bg_page.inheritable
 
-    for i in range(len(overlay_pdf.pages)):
-        # 每次重新读取模板页，确保是新对象
-        bg_page = PdfReader(bg_pdf_path).pages[0]
-        ol_page = overlay_pdf.pages[i]
-        merger = PageMerge(bg_page)
-        merger.add(ol_page).render()
-        writer.addpage(bg_page)
+    for ol_page in overlay_pdf.pages:
+        merger = PageMerge(ol_page)
+        merger.add(bg_xobj, prepend=True)  # 模板垫在文字层下面
 
-    # ⚡️ 1. 写入磁盘
-    writer.write(final_pdf_path)
+        # 页面尺寸 / 方向沿用模板
+        merger.mbox = bg_inheritable.MediaBox
+        merger.cbox = bg_inheritable.CropBox
+        merger.rotate = bg_inheritable.Rotate
+        writer.addpage(merger.render())
 
-    # ⚡️ 2. 写入内存 buffer
     buffer = BytesIO()
     writer.write(buffer)
     buffer.seek(0)  # 👈 这一句很重要
 
     return buffer
 
+def draw_page_barcode(c, barcode_id, width, height):
+    # ⚡️ 判断页面横纵向，计算位置
+    if width > height:  # 横向
+        barcode_x, barcode_y = 0, 0
+    else:  # 纵向
+        barcode_x, barcode_y = 0, 0
+
+    # ⚡️ 矢量画二维码，不再 PNG 编码 / 解码，任何 DPI 都清晰
+    draw_qr_vector(c, str(barcode_id), barcode_x + 5, barcode_y + 5, 50)
+    # 条形码上方加文字（打印数字 ID）
+    c.setFont("TW-Kai", 10)
+    c.setFillColor(colors.black)
+    c.drawString(barcode_x + 22, barcode_y + 50, str(barcode_id))
+
+
+# ========= 多进程渲染 =========
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+def get_render_pool():
+    """懒加载的渲染进程池；用 spawn，子进程不继承数据库连接 / eventlet hub"""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = ProcessPoolExecutor(
+                max_workers=PAIWEI_RENDER_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _render_pool
+
+def reset_render_pool():
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is not None:
+            _render_pool.shutdown(wait=False, cancel_futures=True)
+        _render_pool = None
+
+def render_paiwei_payload(payload):
+    """子进程入口：payload 里只有普通 dict / list，返回 PDF bytes"""
+    buffer = render_paiwei(
+        payload['paiwei_type'],
+        payload['fahui_data'],
+        payload['point_data'],
+        payload['souce_name'],
+        payload.get('page_barcodes'),
+    )
+    return buffer.getvalue()
+
+def build_paiwei_payloads(paiwei_type, fahui_data, point_data, souce_name, page_barcodes=None):
+    """把一个 code 分组切成多个渲染 payload，分块边界对齐到整页"""
+    _, positions = get_point_positions(point_data)
+    chunk_size = max(len(positions), 1) * PAIWEI_PAGES_PER_CHUNK
+
+    payloads = []
+    for start in range(0, len(fahui_data), chunk_size):
+        chunk_barcodes = None
+        if page_barcodes is not None:
+            # page_start 换算成分块内的相对位置
+            chunk_barcodes = {
+                page_start - start: barcode_id
+                for page_start, barcode_id in page_barcodes.items()
+                if start <= page_start < start + chunk_size
+            }
+
+        payloads.append({
+            'paiwei_type': paiwei_type,
+            'fahui_data': fahui_data[start:start + chunk_size],
+            'point_data': point_data,
+            'souce_name': souce_name,
+            'page_barcodes': chunk_barcodes,
+        })
+    return payloads
+
+def merge_pdf_chunks(chunks):
+    """按顺序合并各分块的 PDF bytes"""
+    if len(chunks) == 1:
+        return BytesIO(chunks[0])
+
+    writer = PdfWriter()
+    for data in chunks:
+        writer.addpages(PdfReader(fdata=data).pages)
+
+    buffer = BytesIO()
+    writer.write(buffer)
+    buffer.seek(0)
+    return buffer
+
+def render_paiwei_groups(groups, need_barcode=False, save_copy=False, parallel=False):
+    """
+    groups: [(code, items, point_data, source_name), ...]
+    返回 [(code, buffer), ...]，顺序和 groups 一致
+    """
+    return list(iter_paiwei_groups(
+        groups, need_barcode=need_barcode, save_copy=save_copy, parallel=parallel
+    ))
+
+def iter_paiwei_groups(groups, need_barcode=False, save_copy=False, parallel=False, progress=None,
+                       max_groups_in_flight=None):
+    """
+    按 groups 顺序逐个 yield (code, buffer)
+    - 默认顺序渲染：用到哪个分组才渲染哪个
+    - parallel=True：分组、以及大分组里的页块丢进进程池并行渲染
+    - max_groups_in_flight：最多同时提交几个分组（None = 一次全部提交）；
+      流式输出时传 1，上一个分组 yield 出去之后才提交下一个，内存只占一个分组
+    - progress(pages)：渲染进度回调（并行模式按分块汇报）
+    """
+    if not parallel:
+        for code, items, point_data, source_name in groups:
+            yield code, generate_paiwei(
+                code, items, point_data, source_name,
+                need_barcode=need_barcode, save_copy=save_copy, progress=progress
+            )
+        return
+
+    pool = get_render_pool()
+
+    def submit(code, items, point_data, source_name):
+        # 数据库相关（条码分配）在当前进程做完，再提交渲染
+        items = prepare_fahui_data(code, items)
+
+        page_barcodes = None
+        if need_barcode:
+            page_barcodes = assign_page_barcodes(items, point_data, source_name)
+
+        payloads = build_paiwei_payloads(code, items, point_data, source_name, page_barcodes)
+        futures = [
+            (pool.submit(render_paiwei_payload, payload), count_paiwei_pages(payload['fahui_data'], point_data))
+            for payload in payloads
+        ]
+        return code, source_name, futures
+
+    remaining = iter(groups)
+    in_flight = deque()
+
+    def fill():
+        while max_groups_in_flight is None or len(in_flight) < max_groups_in_flight:
+            group = next(remaining, None)
+            if group is None:
+                return
+            in_flight.append(submit(*group))
+
+    # 按原顺序收结果并合并
+    try:
+        fill()
+        while in_flight:
+            code, source_name, futures = in_flight.popleft()
+            chunks = []
+            for future, pages in futures:
+                chunks.append(future.result())
+                if progress:
+                    progress(pages)
+
+            buffer = merge_pdf_chunks(chunks)
+            del chunks, futures
+            if save_copy:
+                save_paiwei_copy(buffer, f'{source_name}_{code}_output.pdf')
+            yield code, buffer
+
+            fill()
+    except BrokenProcessPool:
+        # 子进程挂了，下次重新建池
+        reset_render_pool()
+        raise
+
+
+@lru_cache(maxsize=4096)
+def get_qr_matrix(data):
+    """二维码模块矩阵（含 4 格白边，和 qrcode.make 一致），按内容缓存"""
+    qr = qrcode.QRCode(border=4)
+    qr.add_data(data)
+    qr.make(fit=True)
+    return tuple(tuple(row) for row in qr.get_matrix())
+
+def draw_qr_vector(c, data, x, y, size):
+    """用 reportlab 路径画二维码：白底 + 每行连续黑块合并成一个矩形，一次填充"""
+    matrix = get_qr_matrix(data)
+    module = size / len(matrix)
+
+    c.saveState()
+    c.setFillColor(colors.white)
+    c.rect(x, y, size, size, stroke=0, fill=1)
+
+    path = c.beginPath()
+    for r, row in enumerate(matrix):
+        row_y = y + size - (r + 1) * module
+        col, n = 0, len(row)
+        while col < n:
+            if not row[col]:
+                col += 1
+                continue
+            start = col
+            while col < n and row[col]:
+                col += 1
+            path.rect(x + start * module, row_y, (col - start) * module, module)
+
+    c.setFillColor(colors.black)
+    c.drawPath(path, stroke=0, fill=1)
+    c.restoreState()
+
+def load_template_xobj(bg_pdf_path):
+    """解析模板第一页，返回 (page, form_xobj)；同一个 xobj 可以反复贴到多页上"""
+    bg_page = PdfReader(bg_pdf_path).pages[0]
+
+    # 页面的 Rotate 保留在输出页上，xobj 本身不再旋转，和原来直接叠加的效果一致
+    rotate = -int(bg_page.inheritable.Rotate or 0)
+    bg_xobj = pagexobj(bg_page, ViewInfo(rotate=rotate))
+    return bg_page, bg_xobj
+
+def save_paiwei_copy(buffer, final_file_name):
+    """把生成结果存档到 paiwei_result/，先写临时文件再替换，避免并发写坏"""
+    output_path = os.path.join(data_path, 'paiwei_result')
+    os.makedirs(output_path, exist_ok=True)
+
+    final_pdf_path = os.path.join(output_path, final_file_name)
+    tmp_path = f'{final_pdf_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+    with open(tmp_path, 'wb') as f:
+        f.write(buffer.getvalue())
+    os.replace(tmp_path, final_pdf_path)
+
 import json
 @print_paiwei_bp.route('/get_point_json', methods=['GET'])
 @login_required
 def get_point_json():
-    json_file_path = os.path.join(data_path, 'point.json')
-    with open(json_file_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    return jsonify(data)
+    return jsonify(PaiweiLayoutService.load_json('point'))
 
 @print_paiwei_bp.route('/update_point_json', methods=['POST'])
 @login_required
@@ -722,6 +1294,9 @@ def update_point_json():
         with open(json_file_path, 'w', encoding='utf-8') as f:
             json.dump(new_data, f, ensure_ascii=False, indent=2)
 
+        # 立即作废缓存，不等 mtime 变化（同一秒内多次保存也能生效）
+        PaiweiLayoutService.invalidate('point')
+
         return jsonify({"success": True, "message": "point.json 更新成功"})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
@@ -1,10 +1,17 @@
 from app.extensions import db
 from datetime import datetime
-from sqlalchemy.orm import relationship
-from sqlalchemy import event,inspect
+from sqlalchemy.orm import relationship, column_property
+from sqlalchemy import event,inspect,select,func,or_,and_
+import hashlib
 
 class Order(db.Model):
     __tablename__ = 'orders'
+    __table_args__ = (
+        # 搜索分页：WHERE version = ? ORDER BY created_at DESC, id DESC
+        db.Index('ix_orders_version_created_at', 'version', 'created_at', 'id'),
+        # 详情页上一单 / 下一单：WHERE version = ? AND id < / > ? 取 MAX / MIN(id)
+        db.Index('ix_orders_version_id', 'version', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)  # 自动递增的主键
     name = db.Column(db.String(100), nullable=True)
@@ -12,8 +19,13 @@ class Order(db.Model):
     customer_name = db.Column(db.String(100), nullable=True)
     member_name = db.Column(db.String(100), nullable=True)
     phone = db.Column(db.String(20), nullable=True)
+    # 电话只保留数字 + 反转后的数字（尾号查询 = 反转列前缀查询，可以走索引）
+    phone_digits = db.Column(db.String(20), nullable=True, index=True)
+    phone_digits_rev = db.Column(db.String(20), nullable=True, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     version = db.Column(db.Integer, nullable=False) 
+    # 从哪张旧订单复制过来的（跨 version 续办）
+    source_order_id = db.Column(db.Integer, nullable=True, index=True)
     payments = db.relationship('PaymentData', back_populates='order', cascade='all, delete-orphan')
 
     # 反向关系，表明每个订单可以有多个 OrderItem
@@ -24,6 +36,16 @@ class Order(db.Model):
         passive_deletes=True
     )
 
+    @staticmethod
+    def normalize_phone(phone) -> str | None:
+        digits = "".join(ch for ch in str(phone or "") if ch.isdigit())
+        return digits or None
+
+    @staticmethod
+    def phone_suffix_filter(digits: str):
+        """电话尾号匹配（phone_digits_rev LIKE '反转%'）"""
+        return Order.phone_digits_rev.like(f"{digits[::-1]}%")
+
     def __repr__(self):
         return f"<Order(id={self.id}, status={self.status}, customer_name={self.customer_name}, created_at={self.created_at}, version={self.version})>"
 
@@ -40,6 +62,8 @@ class OrderItem(db.Model):
     code = db.Column(db.String(20))
     item_name = db.Column(db.String(100))
     price = db.Column(db.Float)
+    # 从哪条旧明细复制过来的（批量续办时用来对应表单数据）
+    source_item_id = db.Column(db.Integer, nullable=True, index=True)
 
     order = relationship('Order', back_populates='order_items')
     pdf_pages = db.relationship('PDFPageData', back_populates='order_item', cascade='all, delete-orphan')
@@ -81,18 +105,42 @@ class BoardHeader(db.Model):
     board_width = db.Column(db.Integer)
     board_height = db.Column(db.Integer)
 
+    # 最后一次改动这块板时的全局 revision（BoardRevision 计数器的值）
+    revision = db.Column(db.Integer, nullable=False, default=0, index=True)
+
     board_data = db.relationship(
         "BoardData",
         back_populates="board",
-        order_by="BoardData.created_at"
+        order_by="(BoardData.sort_key, BoardData.id)"
     )
 
     def __repr__(self):
         return f"<BoardHeader id={self.id} name={self.board_name}>"
 
 
+class BoardRevision(db.Model):
+    __tablename__ = 'board_revision'
+
+    # 单行计数器：SELECT ... FOR UPDATE 锁住再 +1，持锁到 commit，
+    # revision 按提交顺序可见（AUTO_INCREMENT 在 flush 时分配，提交顺序可能颠倒）
+    COUNTER_ID = 1
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    revision = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<BoardRevision(revision={self.revision})>"
+
+
 class BoardData(db.Model):
     __tablename__ = 'board_data'
+    __table_args__ = (
+        # 板内排序 / 找相邻位置：WHERE board_id = ? ORDER BY sort_key, id
+        db.Index('ix_board_data_board_sort', 'board_id', 'sort_key', 'id'),
+    )
+
+    # 相邻位置之间留的间隔：拖动只改被拖的那一行，间隔用完才整板重排
+    SORT_GAP = 1024
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     board_id = db.Column(db.Integer, db.ForeignKey('board_header.id'), nullable=False, index=True)
@@ -102,8 +150,8 @@ class BoardData(db.Model):
     board = db.relationship('BoardHeader', back_populates='board_data')
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
-    # ✅ 新字段：记录该 pdf 在 board 内的序号
-    location = db.Column(db.Integer, nullable=True)
+    # ✅ 稀疏排序键（间隔 SORT_GAP）；对外的 1..N 序号 location 由它推算
+    sort_key = db.Column(db.Integer, nullable=True)
 
     def __repr__(self):
         return f"<BoardData(id={self.id}, board_id={self.board_id}, location={self.location})>"
@@ -118,6 +166,34 @@ class BoardData(db.Model):
         }
 
 
+# ✅ location：板内排在它前面（含自己）的位置数，即 1..N 序号
+# - 顺序和 BoardService._slot_order 一致：sort_key 升序，还没有 sort_key 的排最后（按 id）
+# - deferred：相关子查询只在真正读 .location 时才跑，批量加载 BoardData 不会每行都数一遍
+_board_slot = BoardData.__table__.alias("board_slot")
+BoardData.location = column_property(
+    select(func.count(_board_slot.c.id))
+    .where(
+        _board_slot.c.board_id == BoardData.board_id,
+        or_(
+            and_(
+                BoardData.sort_key.isnot(None),
+                or_(
+                    _board_slot.c.sort_key < BoardData.sort_key,
+                    and_(_board_slot.c.sort_key == BoardData.sort_key, _board_slot.c.id <= BoardData.id),
+                ),
+            ),
+            and_(
+                BoardData.sort_key.is_(None),
+                or_(_board_slot.c.sort_key.isnot(None), _board_slot.c.id <= BoardData.id),
+            ),
+        ),
+    )
+    .correlate_except(_board_slot)
+    .scalar_subquery(),
+    deferred=True,
+)
+
+
 class PrintPDF(db.Model):
     __tablename__ = 'print_pdf'
 
@@ -128,12 +204,21 @@ class PrintPDF(db.Model):
     width = db.Column(db.Integer, nullable=True)   # PDF 宽度
     height = db.Column(db.Integer, nullable=True)  # PDF 高度
 
+    # ✅ 页面指纹：排序去重后的 order_item_id 做 sha256，同一组内容只对应一条 PrintPDF
+    page_fingerprint = db.Column(db.String(64), nullable=True, unique=True, index=True)
+
     # ✅ 一对多关系
     page_data = db.relationship('PDFPageData', back_populates='print_pdf', cascade='all, delete-orphan')
 
     def __repr__(self):
         return f"<PrintPDF(id={self.id}, created_at={self.created_at}, width={self.width}, height={self.height})>"
 
+    @staticmethod
+    def build_fingerprint(order_item_ids):
+        """order_item_id 集合的规范哈希，和顺序 / 重复无关"""
+        canonical = ",".join(str(oid) for oid in sorted({int(oid) for oid in order_item_ids}))
+        return hashlib.sha256(canonical.encode("ascii")).hexdigest()
+
     def to_dict(self):
         return {
             "id": self.id,  # 本身就是 page_id
@@ -185,13 +270,28 @@ def protect_order_update(mapper, connection, target):
     state = inspect(target)
     changed = {attr.key for attr in state.attrs if attr.history.has_changes()}
 
-    # 只允许改 phone
-    if changed != {"phone"}:
+    # 只允许改 phone（phone_digits / phone_digits_rev 跟着 phone 走）
+    if changed - PHONE_DERIVED_FIELDS != {"phone"}:
         raise ValueError(
             f"Order version '{target.version}' is read-only (except phone)."
         )
 
 
+PHONE_DERIVED_FIELDS = {"phone_digits", "phone_digits_rev"}
+
+
+@event.listens_for(Order, "before_insert", propagate=True)
+@event.listens_for(Order, "before_update", propagate=True)
+def sync_order_phone_digits(mapper, connection, target):
+    # 两列各自比较：只有一列过期（或是 NULL）的也会修好
+    digits = Order.normalize_phone(target.phone)
+    digits_rev = digits[::-1] if digits else None
+    if target.phone_digits != digits:
+        target.phone_digits = digits
+    if target.phone_digits_rev != digits_rev:
+        target.phone_digits_rev = digits_rev
+
+
 @event.listens_for(Order, "before_delete", propagate=True)
 def protect_order_delete(mapper, connection, target):
     if is_order_read_only(target):
@@ -235,3 +335,7 @@ def protect_item_form_data(mapper, connection, target):
         raise ValueError(
             f"Cannot modify ItemFormData: parent Order version '{order.version}' is read-only."
         )
+
+
+# 搜索索引的同步事件挂在 Order / OrderItem / ItemFormData 上，模型加载时一起注册
+from app.models import order_search  # noqa: E402,F401
@@ -0,0 +1,250 @@
+# models/order_search.py
+from app.extensions import db
+from app.models.fahui import Order, OrderItem, ItemFormData
+from sqlalchemy import event, inspect, select, delete, func
+from sqlalchemy.orm import Session, object_session
+from sqlalchemy.orm.base import NO_VALUE
+import unicodedata
+
+# order_search_doc  : 每个订单一行，拼好的可搜索文本（name / customer_name / phone / phone_digits / 所有 field_value）
+# order_search_gram : 文本切出来的 1-gram + 2-gram，(gram, order_id) 索引，短的中文名也能走索引
+
+SEARCH_TEXT_SEPARATOR = "\n"
+DIRTY_KEY = "order_search_dirty"
+
+
+class OrderSearchDoc(db.Model):
+    __tablename__ = 'order_search_doc'
+
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id', ondelete="CASCADE"), primary_key=True)
+    search_text = db.Column(db.Text, nullable=False, default="")
+
+    def __repr__(self):
+        return f"<OrderSearchDoc(order_id={self.order_id})>"
+
+
+class OrderSearchGram(db.Model):
+    __tablename__ = 'order_search_gram'
+
+    # utf8mb4_bin：默认排序规则下 "n" = "n "（PAD SPACE）、"e" = "é"，主键会撞车
+    gram = db.Column(db.String(8, collation="utf8mb4_bin"), primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id', ondelete="CASCADE"), primary_key=True, index=True)
+
+    def __repr__(self):
+        return f"<OrderSearchGram(gram={self.gram}, order_id={self.order_id})>"
+
+    # ========= 切词 =========
+
+    @staticmethod
+    def normalize(text) -> str:
+        """全角转半角 + 小写，和 ilike 一样不分大小写"""
+        return unicodedata.normalize("NFKC", str(text or "")).lower()
+
+    @staticmethod
+    def grams(text: str) -> set:
+        """索引用：所有 1-gram + 2-gram（带空白的都跳过）"""
+        result = set()
+        for i, ch in enumerate(text):
+            if not ch.isspace():
+                result.add(ch)
+            pair = text[i:i + 2]
+            if len(pair) == 2 and not OrderSearchGram._has_space(pair):
+                result.add(pair)
+        return result
+
+    @staticmethod
+    def query_grams(text: str) -> set:
+        """
+        查询用：单字查 1-gram，两个字以上只查 2-gram
+        - 带空白的 2-gram 不在索引里，跳过（子串确认那一步会补上）
+        - 全部被跳过（如 "a b"）就退回各个字的 1-gram
+        """
+        if len(text) < 2:
+            return {text} if text else set()
+        pairs = {
+            text[i:i + 2] for i in range(len(text) - 1)
+            if not OrderSearchGram._has_space(text[i:i + 2])
+        }
+        return pairs or {ch for ch in text if not ch.isspace()}
+
+    @staticmethod
+    def _has_space(text: str) -> bool:
+        return any(ch.isspace() for ch in text)
+
+    # ========= 查询 =========
+
+    @staticmethod
+    def candidate_order_ids(value: str):
+        """gram 索引取候选（必须包含全部 query gram），还没做子串确认；value 为空返回 None"""
+        grams = OrderSearchGram.query_grams(OrderSearchGram.normalize(value).strip())
+        if not grams:
+            return None
+
+        return (
+            select(OrderSearchGram.order_id)
+            .where(OrderSearchGram.gram.in_(grams))
+            .group_by(OrderSearchGram.order_id)
+            .having(func.count(func.distinct(OrderSearchGram.gram)) == len(grams))
+        )
+
+    @staticmethod
+    def match_order_ids(value: str):
+        """
+        返回匹配 value 的 order_id 子查询
+        1. gram 索引取候选
+        2. 只在候选上对 search_text 做一次子串确认，结果和原来的 ilike 一致
+        """
+        candidates = OrderSearchGram.candidate_order_ids(value)
+        if candidates is None:
+            return None
+
+        text = OrderSearchGram.normalize(value).strip()
+        escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return (
+            select(OrderSearchDoc.order_id)
+            .where(
+                OrderSearchDoc.order_id.in_(candidates),
+                OrderSearchDoc.search_text.like(f"%{escaped}%", escape="\\"),
+            )
+        )
+
+    # ========= 重建 =========
+
+    @staticmethod
+    def rebuild(connection, order_ids):
+        """用 Core 语句重建指定订单的索引（可以在 flush 事件里直接用当前连接）"""
+        order_ids = sorted({oid for oid in order_ids if oid is not None})
+        if not order_ids:
+            return
+
+        connection.execute(delete(OrderSearchGram.__table__).where(OrderSearchGram.order_id.in_(order_ids)))
+        connection.execute(delete(OrderSearchDoc.__table__).where(OrderSearchDoc.order_id.in_(order_ids)))
+
+        parts = {}
+        member_names = {}
+        for oid, name, customer_name, phone, phone_digits, member_name in connection.execute(
+            select(Order.id, Order.name, Order.customer_name, Order.phone, Order.phone_digits, Order.member_name)
+            .where(Order.id.in_(order_ids))
+        ):
+            # phone_digits：输入连续数字也能命中 "012-345 6789" 这种写法
+            parts[oid] = [name, customer_name, phone, phone_digits]
+            member_names[oid] = member_name
+
+        if not parts:
+            return  # 订单都已删除
+
+        for oid, value in connection.execute(
+            select(OrderItem.order_id, ItemFormData.field_value)
+            .join(ItemFormData, ItemFormData.item_id == OrderItem.id)
+            .where(OrderItem.order_id.in_(list(parts)))
+            .order_by(ItemFormData.id)
+        ):
+            parts[oid].append(value)
+
+        docs = []
+        gram_rows = []
+        for oid, values in parts.items():
+            text = SEARCH_TEXT_SEPARATOR.join(
+                OrderSearchGram.normalize(v) for v in values if v
+            )
+            docs.append({"order_id": oid, "search_text": text})
+
+            # member_name 只进 gram（即时搜索用 candidate_order_ids 取候选），不进 search_text，
+            # /search 的匹配范围不变
+            grams = OrderSearchGram.grams(text) | OrderSearchGram.grams(OrderSearchGram.normalize(member_names[oid]))
+            gram_rows.extend({"gram": g, "order_id": oid} for g in grams)
+
+        connection.execute(OrderSearchDoc.__table__.insert(), docs)
+        if gram_rows:
+            connection.execute(OrderSearchGram.__table__.insert(), gram_rows)
+
+    @staticmethod
+    def rebuild_all(batch_size: int = 500) -> int:
+        """全量重建（第一次上线 / 数据修复用），返回处理的订单数"""
+        total = 0
+        last_id = 0
+        while True:
+            ids = [
+                oid for (oid,) in db.session.query(Order.id)
+                .filter(Order.id > last_id)
+                .order_by(Order.id)
+                .limit(batch_size)
+            ]
+            if not ids:
+                break
+
+            OrderSearchGram.rebuild(db.session.connection(), ids)
+            db.session.commit()
+            total += len(ids)
+            last_id = ids[-1]
+        return total
+
+
+# ========= ORM 事件：记录受影响的订单，flush 完再统一重建 =========
+
+SEARCH_ORDER_FIELDS = {"name", "customer_name", "phone", "member_name"}
+
+
+def mark_order_dirty(target, order_id):
+    session = object_session(target)
+    if session is None or order_id is None:
+        return
+    session.info.setdefault(DIRTY_KEY, set()).add(order_id)
+
+
+def has_changes(target, fields) -> bool:
+    state = inspect(target)
+    return any(state.attrs[f].history.has_changes() for f in fields)
+
+
+@event.listens_for(Order, "after_insert", propagate=True)
+@event.listens_for(Order, "after_delete", propagate=True)
+def order_search_touch_order(mapper, connection, target):
+    mark_order_dirty(target, target.id)
+
+
+@event.listens_for(Order, "after_update", propagate=True)
+def order_search_update_order(mapper, connection, target):
+    if has_changes(target, SEARCH_ORDER_FIELDS):
+        mark_order_dirty(target, target.id)
+
+
+@event.listens_for(OrderItem, "after_insert", propagate=True)
+@event.listens_for(OrderItem, "after_update", propagate=True)
+@event.listens_for(OrderItem, "after_delete", propagate=True)
+def order_search_touch_item(mapper, connection, target):
+    mark_order_dirty(target, target.order_id)
+
+    # 换了订单：旧订单也要重建
+    history = inspect(target).attrs.order_id.history
+    for old_order_id in history.deleted or ():
+        mark_order_dirty(target, old_order_id)
+
+
+@event.listens_for(ItemFormData, "after_insert", propagate=True)
+@event.listens_for(ItemFormData, "after_update", propagate=True)
+@event.listens_for(ItemFormData, "after_delete", propagate=True)
+def order_search_touch_form_data(mapper, connection, target):
+    # flush 事件里不能触发懒加载：item 已经在内存里才用，否则用当前连接直接查
+    item = inspect(target).attrs.item.loaded_value
+    if item is not None and item is not NO_VALUE:
+        order_id = item.order_id
+    elif target.item_id:
+        order_id = connection.execute(
+            select(OrderItem.order_id).where(OrderItem.id == target.item_id)
+        ).scalar()
+    else:
+        order_id = None
+    mark_order_dirty(target, order_id)
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def order_search_rebuild_dirty(session, flush_context):
+    dirty = session.info.pop(DIRTY_KEY, None)
+    if dirty:
+        OrderSearchGram.rebuild(session.connection(), dirty)
+
+
+@event.listens_for(Session, "after_rollback")
+def order_search_clear_dirty(session):
+    session.info.pop(DIRTY_KEY, None)
@@ -1,8 +1,9 @@
 # services/board_service.py
 
+from sqlalchemy import select, update, bindparam
 from sqlalchemy.orm import joinedload
 from app.extensions import db
-from app.models.fahui import BoardHeader, BoardData
+from app.models.fahui import BoardHeader, BoardData, BoardRevision, PrintPDF, PDFPageData, Order, OrderItem, ItemFormData
 
 
 class BoardService:
@@ -21,7 +22,8 @@ class BoardService:
             return None
 
         board = board_data.board
-        total_on_board = len(board.board_data)
+        total_on_board = db.session.query(db.func.count(BoardData.id)) \
+            .filter(BoardData.board_id == board.id).scalar()
 
         return {
             "board_id": board.id,
@@ -33,68 +35,248 @@ class BoardService:
     # ========= 汇总查询 =========
 
     @staticmethod
-    def get_all_boards_with_orders():
+    def get_all_boards_with_orders(board_ids=None):
+        """
+        所有牌位板（或指定 board_ids）+ 每个位置上的订单
+        ⚡️ 两条查询：① 板 / 位置 / PDF 尺寸 ② 位置上的所有页面行（含 owner / deceased 挑选），
+        再在 Python 里一次线性组装
+        """
+        if board_ids is not None and not board_ids:
+            return []
+
+        slot_orders = BoardService._collect_slot_orders(board_ids)
+
+        query = (
+            db.session.query(
+                BoardHeader.id,
+                BoardHeader.board_name,
+                BoardHeader.board_width,
+                BoardHeader.board_height,
+                BoardData.id,
+                BoardData.print_pdf_id,
+                PrintPDF.width,
+                PrintPDF.height,
+            )
+            .outerjoin(BoardData, BoardData.board_id == BoardHeader.id)
+            .outerjoin(PrintPDF, PrintPDF.id == BoardData.print_pdf_id)
+        )
+        if board_ids is not None:
+            query = query.filter(BoardHeader.id.in_(board_ids))
+
+        # location 按板内顺序直接数出来，不用每行再跑一次 location 子查询
+        slot_rows = query.order_by(BoardHeader.id, *BoardService._slot_order()).all()
 
-        headers = db.session.query(BoardHeader).all()
         result = []
+        boards = {}
+        for (board_id, board_name, board_width, board_height,
+             side_id, print_pdf_id, width, height) in slot_rows:
+            board = boards.get(board_id)
+            if board is None:
+                board = boards[board_id] = {
+                    "board_id": board_id,
+                    "board_name": board_name,
+                    "board_width": board_width,
+                    "board_height": board_height,
+                    "board_data": []
+                }
+                result.append(board)
+
+            if side_id is None:
+                continue  # 空板
 
-        for header in headers:
-            grouped = []
-
-            for b in header.board_data:
-                order_seen = set()
-                order_list = []
-
-                pdf = b.print_pdf
-                if pdf:
-                    for pd in pdf.page_data:
-                        if not (pd.order_item and pd.order_item.order):
-                            continue
-
-                        order = pd.order_item.order
-                        if order.id in order_seen:
-                            continue
-
-                        order_seen.add(order.id)
-
-                        owner_or_deceased = None
-                        form_data = pd.order_item.item_form_data or []
-
-                        # 优先 owner
-                        for fd in form_data:
-                            if fd.field_name == "owner":
-                                owner_or_deceased = fd.field_value
-                                break
-
-                        # fallback deceased
-                        if not owner_or_deceased:
-                            for fd in form_data:
-                                if fd.field_name == "deceased":
-                                    owner_or_deceased = fd.field_value
-                                    break
-
-                        order_list.append({
-                            "order_item_id": pd.order_item.id,
-                            "order_id": order.id,
-                            "customer_name": order.customer_name,
-                            "owner_or_deceased": owner_or_deceased
-                        })
-
-                grouped.append({
-                    "width": pdf.width if pdf else None,
-                    "height": pdf.height if pdf else None,
-                    "print_pdf_id": b.print_pdf_id,
-                    "side_id": b.id,
-                    "location": b.location,
-                    "orders": order_list
-                })
-
-            result.append({
-                "board_id": header.id,
-                "board_name": header.board_name,
-                "board_width": header.board_width,
-                "board_height": header.board_height,
-                "board_data": grouped
+            board["board_data"].append({
+                "width": width,
+                "height": height,
+                "print_pdf_id": print_pdf_id,
+                "side_id": side_id,
+                "location": len(board["board_data"]) + 1,
+                "orders": slot_orders.get(side_id, [])
             })
 
         return result
+
+    @staticmethod
+    def _first_form_value(field_name: str):
+        """该明细第一条 field_name 的值（相关子查询，走 item_id 索引）"""
+        return (
+            select(ItemFormData.field_value)
+            .where(
+                ItemFormData.item_id == OrderItem.id,
+                ItemFormData.field_name == field_name,
+            )
+            .order_by(ItemFormData.id)
+            .limit(1)
+            .correlate(OrderItem)
+            .scalar_subquery()
+        )
+
+    @staticmethod
+    def _collect_slot_orders(board_ids=None) -> dict:
+        """
+        side_id -> [{order_item_id, order_id, customer_name, owner_or_deceased}, ...]
+        - 同一个位置上同一订单只取第一页
+        - owner 优先，没有（或为空）再用 deceased
+        """
+        rows = (
+            db.session.query(
+                BoardData.id,
+                OrderItem.id,
+                Order.id,
+                Order.customer_name,
+                BoardService._first_form_value("owner"),
+                BoardService._first_form_value("deceased"),
+            )
+            .join(PDFPageData, PDFPageData.print_pdf_id == BoardData.print_pdf_id)
+            .join(OrderItem, OrderItem.id == PDFPageData.order_item_id)
+            .join(Order, Order.id == OrderItem.order_id)
+        )
+        if board_ids is not None:
+            rows = rows.filter(BoardData.board_id.in_(board_ids))
+        rows = rows.order_by(BoardData.id, PDFPageData.id).all()
+
+        slot_orders = {}
+        seen = set()
+        for side_id, order_item_id, order_id, customer_name, owner, deceased in rows:
+            if (side_id, order_id) in seen:
+                continue
+            seen.add((side_id, order_id))
+
+            slot_orders.setdefault(side_id, []).append({
+                "order_item_id": order_item_id,
+                "order_id": order_id,
+                "customer_name": customer_name,
+                "owner_or_deceased": owner if owner or deceased is None else deceased
+            })
+
+        return slot_orders
+
+    # ========= 板内排序（稀疏 sort_key） =========
+
+    @staticmethod
+    def lock_board(board_id: int):
+        """
+        SELECT ... FOR UPDATE 锁住这块板的 BoardHeader，同一块板的拖动 / 新增排队执行
+        - 锁到调用方 commit / rollback 为止；板不存在返回 None
+        """
+        return db.session.get(BoardHeader, board_id, with_for_update=True)
+
+    @staticmethod
+    def next_sort_key(board_id: int) -> int:
+        """排到最后一个位置后面"""
+        last = db.session.query(db.func.max(BoardData.sort_key)) \
+            .filter(BoardData.board_id == board_id).scalar()
+        return (last or 0) + BoardData.SORT_GAP
+
+    @staticmethod
+    def move_slot(entry: BoardData, location: int) -> int:
+        """
+        把 entry 挪到第 location 位（1..N，超出范围就放到两端），返回实际位置
+        ⚡️ 只改 entry 一行的 sort_key：取新位置前后两个邻居的中间值；
+        邻居之间没有空隙了才整板重排一次
+        - 调用方先 lock_board()
+        """
+        for _ in range(2):
+            total = db.session.query(db.func.count(BoardData.id)) \
+                .filter(BoardData.board_id == entry.board_id, BoardData.id != entry.id).scalar()
+            location = min(max(location, 1), total + 1)
+
+            # 除 entry 外按顺序排好，新位置前后的两个邻居
+            has_prev = location > 1
+            neighbours = [
+                key for (key,) in db.session.query(BoardData.sort_key)
+                .filter(BoardData.board_id == entry.board_id, BoardData.id != entry.id)
+                .order_by(*BoardService._slot_order())
+                .offset(location - 2 if has_prev else 0)
+                .limit(2 if has_prev else 1)
+            ]
+            # 邻居里有还没 sort_key 的（老数据）→ 直接重排
+            if None not in neighbours:
+                prev_key = neighbours.pop(0) if has_prev else None
+                next_key = neighbours[0] if neighbours else None
+                sort_key = BoardService._key_between(prev_key, next_key)
+                if sort_key is not None:
+                    entry.sort_key = sort_key
+                    return location
+
+            BoardService.renumber(entry.board_id)
+
+        raise RuntimeError(f"board_id={entry.board_id} 重排后仍无法定位")
+
+    @staticmethod
+    def _slot_order():
+        """板内顺序：sort_key 升序，还没有 sort_key 的排最后"""
+        return BoardData.sort_key.is_(None), BoardData.sort_key, BoardData.id
+
+    @staticmethod
+    def _key_between(prev_key, next_key):
+        """prev 和 next 之间的整数（None 表示那一侧没有邻居）；没有空隙返回 None"""
+        if prev_key is None and next_key is None:
+            return BoardData.SORT_GAP
+        if next_key is None:
+            return prev_key + BoardData.SORT_GAP
+        if prev_key is None:
+            return next_key - BoardData.SORT_GAP
+        if next_key - prev_key < 2:
+            return None
+        return (prev_key + next_key) // 2
+
+    @staticmethod
+    def renumber(board_id: int):
+        """按当前顺序把整块板的 sort_key 重新拉开成 GAP, 2*GAP, ...（NULL 排最后）"""
+        ids = [
+            slot_id for (slot_id,) in db.session.query(BoardData.id)
+            .filter(BoardData.board_id == board_id)
+            .order_by(*BoardService._slot_order())
+        ]
+        slots = BoardData.__table__
+        db.session.execute(
+            update(slots)
+            .where(slots.c.id == bindparam("slot_id"))
+            .values(sort_key=bindparam("new_key")),
+            [
+                {"slot_id": slot_id, "new_key": (index + 1) * BoardData.SORT_GAP}
+                for index, slot_id in enumerate(ids)
+            ],
+        )
+
+        # Core 批量写不会同步 session 里已加载的对象
+        for obj in list(db.session.identity_map.values()):
+            if isinstance(obj, BoardData) and obj.board_id == board_id:
+                db.session.expire(obj, ["sort_key", "location"])
+
+    # ========= 增量（revision） =========
+
+    @staticmethod
+    def bump_revision(board_ids) -> int:
+        """
+        记录这些板被改动了，返回新的全局 revision
+        - 在调用方 commit 之前调用，和改动同一个事务
+        - 计数器行 FOR UPDATE 锁到 commit：后拿到的 revision 一定后提交，?since= 不会漏
+        """
+        board_ids = sorted({int(b) for b in board_ids if b is not None})
+        if not board_ids:
+            return BoardService.current_revision()
+
+        counter = db.session.get(BoardRevision, BoardRevision.COUNTER_ID, with_for_update=True)
+        if counter is None:
+            counter = BoardRevision(id=BoardRevision.COUNTER_ID, revision=0)
+            db.session.add(counter)
+
+        counter.revision += 1
+        db.session.query(BoardHeader).filter(BoardHeader.id.in_(board_ids)) \
+            .update({BoardHeader.revision: counter.revision}, synchronize_session=False)
+        return counter.revision
+
+    @staticmethod
+    def current_revision() -> int:
+        return db.session.query(BoardRevision.revision) \
+            .filter(BoardRevision.id == BoardRevision.COUNTER_ID).scalar() or 0
+
+    @staticmethod
+    def get_boards_since(revision: int) -> list:
+        """revision 之后改动过的板（整块板返回）"""
+        board_ids = [
+            board_id for (board_id,) in db.session.query(BoardHeader.id)
+            .filter(BoardHeader.revision > revision)
+        ]
+        return BoardService.get_all_boards_with_orders(board_ids)
@@ -0,0 +1,192 @@
+# services/order_carry_over_service.py
+
+from datetime import datetime
+
+from sqlalchemy import select, insert, literal, exists, and_, or_, func
+from sqlalchemy.orm import aliased
+
+from app.extensions import db
+from app.function.config import READ_ONLY_ORDER_VERSIONS
+from app.models.fahui import Order, OrderItem, ItemFormData
+from app.models.order_search import OrderSearchGram
+from app.services.order_nav_service import OrderNavService
+from app.services.search_cache_service import SearchCacheService
+
+
+class OrderCarryOverService:
+    """
+    旧订单批量续办到新 version
+    - 每一块订单一个事务：orders / order_items / item_form_data 各一条 INSERT ... SELECT
+    - 新行记下 source_order_id / source_item_id，靠它把明细、表单接到新订单上
+    - 目标 version 里已经有的（复制过的，或同名同电话的）直接跳过
+    """
+
+    CHUNK_SIZE = 200
+
+    ORDER_COPY_COLUMNS = [
+        "name", "email", "customer_name", "member_name",
+        "phone", "phone_digits", "phone_digits_rev",
+    ]
+
+    # ========= 对外方法 =========
+
+    @staticmethod
+    def carry_over(target_version, order_ids=None, source_version=None, chunk_size: int = CHUNK_SIZE):
+        """
+        参数检查后返回进度生成器：每处理完一块 yield 一次
+        {"done": 已处理, "total": 总数, "copied": 新建订单数, "skipped": 跳过数}
+        参数不合法直接抛 ValueError
+        """
+        if target_version in READ_ONLY_ORDER_VERSIONS:
+            raise ValueError(f"Order version '{target_version}' is read-only.")
+        if order_ids is None and source_version is None:
+            raise ValueError("order_ids or source_version is required")
+        if source_version is not None and source_version == target_version:
+            raise ValueError("source_version and target_version must differ")
+
+        return OrderCarryOverService._run(target_version, order_ids, source_version, chunk_size)
+
+    @staticmethod
+    def _run(target_version, order_ids, source_version, chunk_size: int):
+        total = OrderCarryOverService._count_source(order_ids, source_version)
+        progress = {"done": 0, "total": total, "copied": 0, "skipped": 0}
+
+        for chunk in OrderCarryOverService._iter_source_chunks(order_ids, source_version, chunk_size):
+            try:
+                copied = OrderCarryOverService._copy_chunk(chunk, target_version)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+            # 每块提交后马上作废缓存：后面的块出错 / 客户端断开，已提交的也能搜到
+            if copied:
+                SearchCacheService.bump_generation()
+                OrderNavService.bump_generation()
+
+            progress["done"] += len(chunk)
+            progress["copied"] += copied
+            progress["skipped"] += len(chunk) - copied
+            yield dict(progress)
+
+    # ========= 来源订单 =========
+
+    @staticmethod
+    def _count_source(order_ids, source_version) -> int:
+        if order_ids is not None:
+            return len(set(order_ids))
+        return db.session.query(func.count(Order.id)).filter(Order.version == source_version).scalar() or 0
+
+    @staticmethod
+    def _iter_source_chunks(order_ids, source_version, chunk_size: int):
+        if order_ids is not None:
+            ids = sorted(set(order_ids))
+            for start in range(0, len(ids), chunk_size):
+                yield ids[start:start + chunk_size]
+            return
+
+        # 整个 version：按 id keyset 分块
+        last_id = 0
+        while True:
+            ids = [
+                oid for (oid,) in db.session.query(Order.id)
+                .filter(Order.version == source_version, Order.id > last_id)
+                .order_by(Order.id)
+                .limit(chunk_size)
+            ]
+            if not ids:
+                return
+            yield ids
+            last_id = ids[-1]
+
+    # ========= 复制 =========
+
+    @staticmethod
+    def _pending_ids(chunk, target_version) -> list:
+        """这一块里真正需要复制的订单 id"""
+        existing = aliased(Order)
+        already = exists().where(
+            existing.version == target_version,
+            or_(
+                existing.source_order_id == Order.id,
+                and_(existing.name == Order.name, existing.phone == Order.phone),
+            ),
+        )
+        return [
+            oid for (oid,) in db.session.execute(
+                select(Order.id).where(
+                    Order.id.in_(chunk),
+                    Order.version != target_version,
+                    ~already,
+                )
+            )
+        ]
+
+    @staticmethod
+    def _copy_chunk(chunk, target_version) -> int:
+        pending = OrderCarryOverService._pending_ids(chunk, target_version)
+        if not pending:
+            return 0
+
+        orders = Order.__table__
+        items = OrderItem.__table__
+        form_data = ItemFormData.__table__
+        now = datetime.utcnow()
+        copy_cols = OrderCarryOverService.ORDER_COPY_COLUMNS
+
+        # ① orders
+        db.session.execute(
+            insert(orders).from_select(
+                copy_cols + ["created_at", "version", "source_order_id"],
+                select(
+                    *[orders.c[name] for name in copy_cols],
+                    literal(now),
+                    literal(target_version),
+                    orders.c.id,
+                ).where(orders.c.id.in_(pending)),
+            )
+        )
+
+        new_order = orders.alias("new_order")
+        new_in_chunk = and_(
+            new_order.c.version == target_version,
+            new_order.c.source_order_id.in_(pending),
+        )
+
+        # ② order_items：挂到对应的新订单
+        db.session.execute(
+            insert(items).from_select(
+                ["order_id", "code", "item_name", "price", "source_item_id"],
+                select(
+                    new_order.c.id, items.c.code, items.c.item_name, items.c.price, items.c.id,
+                )
+                .select_from(items.join(new_order, new_order.c.source_order_id == items.c.order_id))
+                .where(new_in_chunk),
+            )
+        )
+
+        # ③ item_form_data：按 source_item_id 挂到新明细
+        new_item = items.alias("new_item")
+        db.session.execute(
+            insert(form_data).from_select(
+                ["item_id", "field_name", "field_value"],
+                select(new_item.c.id, form_data.c.field_name, form_data.c.field_value)
+                .select_from(
+                    form_data
+                    .join(new_item, new_item.c.source_item_id == form_data.c.item_id)
+                    .join(new_order, new_order.c.id == new_item.c.order_id)
+                )
+                .where(new_in_chunk)
+                .order_by(form_data.c.id),
+            )
+        )
+
+        # ④ 搜索索引（Core 写入不触发 ORM 事件）
+        new_ids = [
+            oid for (oid,) in db.session.execute(
+                select(new_order.c.id).where(new_in_chunk)
+            )
+        ]
+        OrderSearchGram.rebuild(db.session.connection(), new_ids)
+
+        return len(pending)
@@ -0,0 +1,142 @@
+# services/order_export_service.py
+
+import csv
+import io
+import json
+import zlib
+
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+
+from app.extensions import db
+from app.models.fahui import Order, OrderItem
+from app.services.order_service import OrderService
+
+
+class OrderExportService:
+    """
+    整个 version 的订单导出（NDJSON / CSV），边查边写
+    - 按 id keyset 分批取订单，每批 selectin 一次性带出明细 / 表单 / 付款
+    - 每批写完就 expunge，内存和 version 大小无关
+    """
+
+    BATCH_SIZE = 500
+
+    CSV_COLUMNS = [
+        "order_id", "version", "created_at", "status",
+        "name", "customer_name", "member_name", "email", "phone",
+        "item_id", "code", "item_name", "price",
+        "field_name", "field_value",
+    ]
+
+    # ========= 数据源 =========
+
+    @staticmethod
+    def iter_order_batches(version, batch_size: int = BATCH_SIZE):
+        """
+        按 id 顺序分批返回订单列表
+        - id 走 keyset 分页（id > 上一批最后一个），每批一条普通（缓冲）查询再 selectin 带出关联
+        - 不用 yield_per：pymysql 流式游标没读完之前同一连接不能再发 selectin 查询
+        """
+        last_id = 0
+        while True:
+            ids = [
+                oid for (oid,) in db.session.execute(
+                    select(Order.id)
+                    .where(Order.version == version, Order.id > last_id)
+                    .order_by(Order.id)
+                    .limit(batch_size)
+                )
+            ]
+            if not ids:
+                return
+
+            batch = list(db.session.scalars(
+                select(Order)
+                .where(Order.id.in_(ids))
+                .order_by(Order.id)
+                .options(
+                    selectinload(Order.payments),
+                    selectinload(Order.order_items)
+                    .selectinload(OrderItem.item_form_data),
+                )
+            ))
+            yield batch
+            OrderExportService._release(batch)
+            last_id = ids[-1]
+
+    @staticmethod
+    def _release(orders):
+        """写完的订单移出 session，避免 identity map 越积越大"""
+        for order in orders:
+            for item in order.order_items:
+                for fd in item.item_form_data:
+                    db.session.expunge(fd)
+                db.session.expunge(item)
+            for payment in order.payments:
+                db.session.expunge(payment)
+            db.session.expunge(order)
+
+    # ========= 格式 =========
+
+    @staticmethod
+    def iter_ndjson(version):
+        """每行一个订单（结构同 /search 的登录版 item）"""
+        for batch in OrderExportService.iter_order_batches(version):
+            lines = [
+                json.dumps(OrderService.to_dict(order), ensure_ascii=False, default=str)
+                for order in batch
+            ]
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+
+    @staticmethod
+    def iter_csv(version):
+        """每个表单字段一行；没有明细 / 表单的订单也会输出一行"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        # BOM：Excel 直接打开中文不乱码
+        writer.writerow(OrderExportService.CSV_COLUMNS)
+        yield ("\ufeff" + buffer.getvalue()).encode("utf-8")
+
+        for batch in OrderExportService.iter_order_batches(version):
+            buffer.seek(0)
+            buffer.truncate()
+            for order in batch:
+                for row in OrderExportService._csv_rows(order):
+                    writer.writerow(row)
+            yield buffer.getvalue().encode("utf-8")
+
+    @staticmethod
+    def _csv_rows(order: Order):
+        base = [
+            order.id,
+            order.version,
+            order.created_at.strftime('%Y-%m-%d %H:%M:%S') if order.created_at else "",
+            OrderService._get_payment_status(order),
+            order.name, order.customer_name, order.member_name, order.email, order.phone,
+        ]
+
+        if not order.order_items:
+            yield base + [""] * 6
+            return
+
+        for item in order.order_items:
+            item_cols = [item.id, item.code, item.item_name, item.price]
+            if not item.item_form_data:
+                yield base + item_cols + ["", ""]
+                continue
+            for fd in item.item_form_data:
+                yield base + item_cols + [fd.field_name, fd.field_value]
+
+    # ========= 压缩 =========
+
+    @staticmethod
+    def gzip_stream(chunks):
+        """边压缩边输出（gzip 格式，每批 flush 一次）"""
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
@@ -0,0 +1,133 @@
+# services/order_nav_service.py
+
+import hashlib
+import json
+
+import redis
+from sqlalchemy import event, select, func, inspect
+from sqlalchemy.orm import Session, object_session
+
+from app.extensions import db
+from app.function.redis_client import redis_client
+from app.models.fahui import Order
+from app.models.order_search import OrderSearchGram
+from app.services.search_cache_service import SearchCacheService
+
+
+class OrderNavService:
+    """
+    订单详情页的上一单 / 下一单
+    - 限定在同一个 version 内（可再叠加搜索关键字），按 (version, id) keyset 查
+    - 结果放 Redis；订单新增 / 删除 / 换 version 时整体作废（generation +1）
+    - 带搜索关键字的结果还取决于订单 / 明细 / 表单内容：key 里再带上搜索缓存的 generation，
+      这些表任何写入（含批量）都会让它作废
+    """
+
+    GEN_KEY = "order_nav:gen"
+    CACHE_TTL = 10 * 60
+    DIRTY_KEY = "order_nav_dirty"
+
+    # ========= 缓存 =========
+
+    @staticmethod
+    def _generation(value: str) -> str:
+        if not value:
+            return redis_client.get(OrderNavService.GEN_KEY) or "0"
+
+        nav_gen, search_gen = redis_client.mget(OrderNavService.GEN_KEY, SearchCacheService.GEN_KEY)
+        return f"{nav_gen or 0}.{search_gen or 0}"
+
+    @staticmethod
+    def _cache_key(generation: str, order_id: int, version, value: str) -> str:
+        value_hash = hashlib.sha1(value.encode("utf-8")).hexdigest()[:16] if value else "-"
+        return f"order_nav:{generation}:{version}:{value_hash}:{order_id}"
+
+    @staticmethod
+    def bump_generation():
+        try:
+            redis_client.incr(OrderNavService.GEN_KEY)
+        except redis.RedisError:
+            pass  # Redis 不在只是没缓存，TTL 到期也会自然更新
+
+    # ========= 对外方法 =========
+
+    @staticmethod
+    def neighbors(order_id: int, version, value: str = None):
+        """返回 (prev_id, next_id)"""
+        value = (value or "").strip()
+
+        try:
+            key = OrderNavService._cache_key(
+                OrderNavService._generation(value), order_id, version, value
+            )
+            cached = redis_client.get(key)
+        except redis.RedisError:
+            key, cached = None, None
+
+        if cached:
+            prev_id, next_id = json.loads(cached)
+            return prev_id, next_id
+
+        prev_id, next_id = OrderNavService._query_neighbors(order_id, version, value)
+
+        if key:
+            try:
+                redis_client.set(key, json.dumps([prev_id, next_id]), ex=OrderNavService.CACHE_TTL)
+            except redis.RedisError:
+                pass
+
+        return prev_id, next_id
+
+    # ========= 内部方法 =========
+
+    @staticmethod
+    def _query_neighbors(order_id: int, version, value: str):
+        """一条语句两个标量子查询：ix_orders_version_id (version, id) 上 MAX(id < x) / MIN(id > x)"""
+        conditions = [Order.version == version]
+        if value:
+            matched = OrderSearchGram.match_order_ids(value)
+            if matched is not None:
+                conditions.append(Order.id.in_(matched))
+
+        prev_id = (
+            select(func.max(Order.id))
+            .where(*conditions, Order.id < order_id)
+            .scalar_subquery()
+        )
+        next_id = (
+            select(func.min(Order.id))
+            .where(*conditions, Order.id > order_id)
+            .scalar_subquery()
+        )
+        return tuple(db.session.execute(select(prev_id, next_id)).one())
+
+
+# ========= ORM 事件：订单增删 / 换 version → 提交后作废导航缓存 =========
+
+def mark_order_nav_dirty(target):
+    session = object_session(target)
+    if session is not None:
+        session.info[OrderNavService.DIRTY_KEY] = True
+
+
+@event.listens_for(Order, "after_insert", propagate=True)
+@event.listens_for(Order, "after_delete", propagate=True)
+def order_nav_touch_order(mapper, connection, target):
+    mark_order_nav_dirty(target)
+
+
+@event.listens_for(Order, "after_update", propagate=True)
+def order_nav_update_order(mapper, connection, target):
+    if inspect(target).attrs.version.history.has_changes():
+        mark_order_nav_dirty(target)
+
+
+@event.listens_for(Session, "after_commit")
+def order_nav_after_commit(session):
+    if session.info.pop(OrderNavService.DIRTY_KEY, False):
+        OrderNavService.bump_generation()
+
+
+@event.listens_for(Session, "after_rollback")
+def order_nav_after_rollback(session):
+    session.info.pop(OrderNavService.DIRTY_KEY, None)
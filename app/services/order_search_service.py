@@ -0,0 +1,120 @@
+# services/order_search_service.py
+
+from sqlalchemy import select, literal, case, func, or_, union_all
+from sqlalchemy.orm import selectinload
+
+from app.extensions import db
+from app.models.fahui import Order, OrderItem
+from app.models.order_search import OrderSearchGram
+
+
+class OrderSearchService:
+    """柜台即时搜索：所有匹配方式合成一条打分查询，一次返回前 N 个订单"""
+
+    # 分数越高越靠前；同一订单命中多种方式取最高分
+    SCORE_ORDER_ID = 100
+    SCORE_ORDER_ITEM_ID = 90
+    SCORE_PHONE_SUFFIX = 80
+    SCORE_NAME_EXACT = 70
+    SCORE_MEMBER_NAME = 50
+    SCORE_CONTAINS = 30
+
+    MAX_ID_DIGITS = 10  # 超过 INT 范围的数字不当 id 查
+
+    # ========= 对外方法 =========
+
+    @staticmethod
+    def quick_search(keyword: str, limit: int = 5, include_deleted: bool = True) -> list:
+        """
+        返回 [(order, score), ...]，按分数、创建时间倒序
+        - include_deleted=False：version = DELETE 的订单在 LIMIT 之前就排除（未登录用）
+        """
+        keyword = (keyword or "").strip().lower()
+        if not keyword:
+            return []
+
+        probes = OrderSearchService._build_probes(keyword)
+        if not probes:
+            return []
+
+        ranked = union_all(*probes).subquery()
+        best = (
+            select(ranked.c.order_id, func.max(ranked.c.score).label("score"))
+            .group_by(ranked.c.order_id)
+            .subquery()
+        )
+
+        query = db.session.query(Order, best.c.score).join(best, best.c.order_id == Order.id)
+        if not include_deleted:
+            query = query.filter(or_(Order.version.is_(None), Order.version != "DELETE"))
+
+        rows = (
+            query
+            .options(
+                selectinload(Order.payments),
+                selectinload(Order.order_items)
+                .selectinload(OrderItem.item_form_data),
+            )
+            .order_by(best.c.score.desc(), Order.created_at.desc(), Order.id.desc())
+            .limit(limit)
+            .all()
+        )
+        return [(order, score) for order, score in rows]
+
+    # ========= 内部方法 =========
+
+    @staticmethod
+    def _probe(column, score: int):
+        return select(column.label("order_id"), literal(score).label("score"))
+
+    @staticmethod
+    def _build_probes(keyword: str) -> list:
+        probes = []
+        probe = OrderSearchService._probe
+
+        if keyword.isdigit():
+            if len(keyword) <= OrderSearchService.MAX_ID_DIGITS:
+                number = int(keyword)
+                # ✅ 订单号 / 明细号精确命中
+                probes.append(
+                    probe(Order.id, OrderSearchService.SCORE_ORDER_ID)
+                    .where(Order.id == number)
+                )
+                probes.append(
+                    probe(OrderItem.order_id, OrderSearchService.SCORE_ORDER_ITEM_ID)
+                    .where(OrderItem.id == number)
+                )
+
+            # ✅ 电话尾号（phone_digits_rev 前缀，走索引）
+            probes.append(
+                probe(Order.id, OrderSearchService.SCORE_PHONE_SUFFIX)
+                .where(Order.phone_suffix_filter(keyword))
+            )
+        else:
+            # member_name 的 gram 也在索引里：先取候选，再只在候选上确认 member_name
+            candidates = OrderSearchGram.candidate_order_ids(keyword)
+            if candidates is not None:
+                probes.append(
+                    probe(Order.id, OrderSearchService.SCORE_MEMBER_NAME)
+                    .where(Order.id.in_(candidates), Order.member_name.ilike(f"%{keyword}%"))
+                )
+
+        # ✅ n-gram 索引：name / customer_name / phone / 表单字段 包含关键字；名字完全相同再加分
+        matched = OrderSearchGram.match_order_ids(keyword)
+        if matched is not None:
+            name_exact = or_(
+                func.lower(Order.name) == keyword,
+                func.lower(Order.customer_name) == keyword,
+            )
+            probes.append(
+                select(
+                    Order.id.label("order_id"),
+                    case(
+                        (name_exact, OrderSearchService.SCORE_NAME_EXACT),
+                        else_=OrderSearchService.SCORE_CONTAINS,
+                    ).label("score"),
+                )
+                .where(Order.id.in_(matched))
+            )
+
+        return probes
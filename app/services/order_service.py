@@ -1,11 +1,17 @@
 # services/order_service.py
 
+import base64
+import json
+from datetime import datetime
 from flask_login import current_user
-from app.models.fahui import Order,ItemFormData,OrderItem
-from sqlalchemy import or_
+from app.models.fahui import Order,ItemFormData,OrderItem,PDFPageData,PrintPDF,BoardData
+from app.models.order_search import OrderSearchGram
+from app.services.order_nav_service import OrderNavService
+from app.services.search_cache_service import SearchCacheService
 from app.extensions import db
-from sqlalchemy.orm import joinedload
-from flask import session
+from sqlalchemy import func, or_, and_
+from sqlalchemy.orm import selectinload
+from flask import session, g
 
 class OrderService:
     @staticmethod
@@ -15,71 +21,170 @@ class OrderService:
         page_num: int = 1,
         per_page: int = 20
     ):
-        query = (
-            db.session.query(Order)
-            .options(
-                joinedload(Order.order_items)
-                .joinedload(OrderItem.item_form_data)
-            )
-            .outerjoin(OrderItem, OrderItem.order_id == Order.id)
-            .outerjoin(ItemFormData, ItemFormData.item_id == OrderItem.id)
-            .filter(Order.version == version)
+        # 参数兜底（和 paginate(error_out=False) 一致）
+        page_num = page_num if page_num and page_num > 0 else 1
+        per_page = per_page if per_page and per_page > 0 else 20
+
+        # ⚡️ Redis 结果缓存（按权限范围分开存，写入后自动作废）
+        return SearchCacheService.fetch(
+            version, value, page_num, per_page,
+            lambda: OrderService._search_orders(version, value, page_num, per_page),
         )
 
-        if value and value.strip():
-            like_value = f"%{value.strip()}%"
-            query = query.filter(
-                or_(
-                    Order.name.ilike(like_value),
-                    Order.customer_name.ilike(like_value),
-                    Order.phone.ilike(like_value),
-                    ItemFormData.field_value.ilike(like_value),
-                )
-            )
-
-        query = query.distinct(Order.id)
+    @staticmethod
+    def _search_orders(version: int, value: str, page_num: int, per_page: int):
+        base = OrderService._build_search_query(version, value)
+
+        # ⚡️ 第一阶段：只查这一页的订单 id + 总数（没有 join，不会被明细行放大）
+        total = base.with_entities(func.count(Order.id)).scalar() or 0
+        order_ids = [
+            oid for (oid,) in base.with_entities(Order.id)
+            .order_by(Order.created_at.desc(), Order.id.desc())
+            .limit(per_page)
+            .offset((page_num - 1) * per_page)
+        ]
 
-        pagination = query.order_by(Order.created_at.desc()).paginate(
-            page=page_num,
-            per_page=per_page,
-            error_out=False
-        )
+        # ⚡️ 第二阶段：按 id 批量加载订单 + 明细（selectin，每层一条 IN 查询）
+        orders = OrderService._load_orders(order_ids)
 
+        pages = (total + per_page - 1) // per_page
         return {
-            "items": [OrderService.to_dict(order) for order in pagination.items],
+            "items": [OrderService.to_dict(order) for order in orders],
             "pagination": {
-                "page": pagination.page,
-                "per_page": pagination.per_page,
-                "total": pagination.total,
-                "pages": pagination.pages,
-                "has_next": pagination.has_next,
-                "has_prev": pagination.has_prev,
+                "page": page_num,
+                "per_page": per_page,
+                "total": total,
+                "pages": pages,
+                "has_next": page_num < pages,
+                "has_prev": page_num > 1,
             }
         }
+
+    @staticmethod
+    def search_orders_cursor(
+        version: int,
+        value: str,
+        cursor: str = None,
+        limit: int = 20,
+        with_total: bool = False
+    ):
+        """
+        游标分页（keyset）：按 (created_at, id) 倒序
+        - cursor 为空 = 第一页；next / prev token 由上一次的结果给出
+        - 不管翻到多深，每页都只是一次索引范围扫描
+        - 游标不合法时抛 ValueError
+        """
+        limit = limit if limit and limit > 0 else 20
+        base = OrderService._build_search_query(version, value)
+
+        direction = "next"
+        query = base
+        if cursor:
+            direction, created_at, order_id = OrderService._decode_cursor(cursor)
+            if direction == "next":
+                query = query.filter(or_(
+                    Order.created_at < created_at,
+                    and_(Order.created_at == created_at, Order.id < order_id),
+                ))
+            else:
+                query = query.filter(or_(
+                    Order.created_at > created_at,
+                    and_(Order.created_at == created_at, Order.id > order_id),
+                ))
+
+        if direction == "next":
+            query = query.order_by(Order.created_at.desc(), Order.id.desc())
+        else:
+            query = query.order_by(Order.created_at.asc(), Order.id.asc())
+
+        # 多取一条判断还有没有
+        rows = query.with_entities(Order.id, Order.created_at).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if direction == "prev":
+            rows.reverse()
+
+        orders = OrderService._load_orders([oid for oid, _ in rows])
+
+        if direction == "next":
+            has_next, has_prev = has_more, bool(cursor)
+        else:
+            has_next, has_prev = True, has_more
+
+        first_id, first_created = rows[0] if rows else (None, None)
+        last_id, last_created = rows[-1] if rows else (None, None)
+        cursor_data = {
+            "limit": limit,
+            "next": OrderService._encode_cursor("next", last_created, last_id) if rows and has_next else None,
+            "prev": OrderService._encode_cursor("prev", first_created, first_id) if rows and has_prev else None,
+        }
+        if with_total:
+            cursor_data["total"] = base.with_entities(func.count(Order.id)).scalar() or 0
+
+        return {
+            "items": [OrderService.to_dict(order) for order in orders],
+            "cursor": cursor_data,
+        }
+
     # ========= 内部方法 =========
 
     @staticmethod
     def _build_search_query(version: int, value: str):
-        query = (
-            db.session.query(Order)
-            .outerjoin(OrderItem, OrderItem.order_id == Order.id)
-            .outerjoin(ItemFormData, ItemFormData.item_id == OrderItem.id)
-            .filter(Order.version == version)
-        )
+        query = db.session.query(Order).filter(Order.version == version)
 
+        # ⚡️ 走 n-gram 索引（order_search_gram），不再 join 明细做 %value% 全表扫描
+        # 匹配范围不变：name / customer_name / phone / item_form_data.field_value
         if value and value.strip():
-            like_value = f"%{value.strip()}%"
-            query = query.filter(
-                or_(
-                    Order.name.ilike(like_value),
-                    Order.customer_name.ilike(like_value),
-                    Order.phone.ilike(like_value),
-                    ItemFormData.field_value.ilike(like_value),
-                )
+            matched = OrderSearchGram.match_order_ids(value)
+            if matched is not None:
+                query = query.filter(Order.id.in_(matched))
+
+        # ✅ 没有 join，订单不会重复，不需要 distinct
+        return query
+
+    @staticmethod
+    def _load_orders(order_ids: list) -> list:
+        """按给定 id 顺序批量加载订单（含 payments / order_items / item_form_data）"""
+        if not order_ids:
+            return []
+
+        orders = (
+            db.session.query(Order)
+            .options(
+                selectinload(Order.payments),
+                selectinload(Order.order_items)
+                .selectinload(OrderItem.item_form_data),
             )
+            .filter(Order.id.in_(order_ids))
+            .all()
+        )
+        by_id = {order.id: order for order in orders}
+        return [by_id[oid] for oid in order_ids if oid in by_id]
 
-        # ✅ 指定主键去重，更安全
-        return query.distinct(Order.id)
+    @staticmethod
+    def _encode_cursor(direction: str, created_at, order_id: int) -> str:
+        payload = json.dumps({
+            "d": direction,
+            "c": created_at.isoformat() if created_at else None,
+            "i": order_id,
+        }, separators=(",", ":"))
+        return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+    @staticmethod
+    def _decode_cursor(token: str):
+        """返回 (direction, created_at, order_id)"""
+        try:
+            padded = token + "=" * (-len(token) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+            direction = payload["d"]
+            created_at = datetime.fromisoformat(payload["c"])
+            order_id = int(payload["i"])
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError("invalid cursor") from e
+
+        if direction not in ("next", "prev"):
+            raise ValueError("invalid cursor")
+        return direction, created_at, order_id
 
     # ========= 序列化 =========
     @staticmethod
@@ -223,10 +328,44 @@ class OrderService:
             if order.created_at else None
         )
 
+    # ========= 详情加载计划 =========
+
+    # 详情页用到的整棵对象树：每一层一条 IN 查询，和明细数量无关
+    @staticmethod
+    def _detail_load_plan():
+        items = selectinload(Order.order_items)
+        print_pdf = items.selectinload(OrderItem.pdf_pages).selectinload(PDFPageData.print_pdf)
+        return (
+            selectinload(Order.payments),
+            items.selectinload(OrderItem.item_form_data),
+            print_pdf.selectinload(PrintPDF.page_data).selectinload(PDFPageData.order_item),
+            print_pdf.selectinload(PrintPDF.boards).selectinload(BoardData.board),
+        )
+
     @staticmethod
-    def to_all_detail(order_id: int) -> dict | None:
-        # ① 查订单
-        order = Order.query.get(order_id)
+    def _load_order_detail(order_id: int):
+        """
+        按加载计划取订单；同一个请求里重复取同一订单直接用 g 上的缓存
+        """
+        cache = g.setdefault("order_detail_cache", {})
+        if order_id in cache:
+            return cache[order_id]
+
+        order = (
+            db.session.query(Order)
+            .options(*OrderService._detail_load_plan())
+            .filter(Order.id == order_id)
+            .one_or_none()
+        )
+        cache[order_id] = order
+        return order
+
+    @staticmethod
+    def to_all_detail(order_id) -> dict | None:
+        # ① 查订单（也接受已经查好的 Order）
+        if isinstance(order_id, Order):
+            order_id = order_id.id
+        order = OrderService._load_order_detail(order_id)
         if not order:
             return None
 
@@ -250,22 +389,10 @@ class OrderService:
             for item in order.order_items
         ]
 
-        # ⑤ 前后订单 ID
-        prev_order = (
-            Order.query
-            .filter(Order.id < order.id)
-            .order_by(Order.id.desc())
-            .first()
-        )
-        next_order = (
-            Order.query
-            .filter(Order.id > order.id)
-            .order_by(Order.id.asc())
-            .first()
-        )
+        # ⑤ 前后订单 ID（同一 version 内，Redis 缓存）
+        prev_id, next_id = OrderNavService.neighbors(order.id, order.version)
 
-        order_data["prev_id"] = prev_order.id if prev_order else None
-        order_data["next_id"] = next_order.id if next_order else None
+        order_data["prev_id"] = prev_id
+        order_data["next_id"] = next_id
 
         return order_data
-    
\ No newline at end of file
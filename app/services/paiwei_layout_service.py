@@ -0,0 +1,148 @@
+# services/paiwei_layout_service.py
+
+import json
+import os
+import threading
+
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+from app.function.config import data_path
+
+
+class PaiweiLayoutService:
+    """牌位模板点位 / 字体的进程内缓存（文件 mtime 变化才重新读取）"""
+
+    FONT_NAME = "TW-Kai"
+    FONT_FILE = "kai.ttf"
+
+    # code -> 模板名
+    TEMPLATE_BY_CODE = {
+        "A1": "paiwei_1",
+        "A2": "paiwei_1",
+        "A3": "paiwei_1",
+        "B1": "paiwei_5",
+        "B2": "paiwei_5",
+        "B3": "paiwei_5",
+        "C": "paiwei_10",
+    }
+
+    # 模板名 -> owner_point_X / deceased_point_X 的后缀
+    POINT_SUFFIX_BY_TEMPLATE = {
+        "paiwei_1": "A",
+        "paiwei_5": "B",
+        "paiwei_10": "C",
+    }
+
+    _lock = threading.RLock()
+    _json_cache = {}      # path -> (mtime_ns, data)
+    _font_mtime = None
+
+    # ========= 基础工具 =========
+
+    @staticmethod
+    def _json_path(file_key: str) -> str:
+        return os.path.join(data_path, f"{file_key}.json")
+
+    @staticmethod
+    def load_json(file_key: str):
+        """
+        读取 data_path/{file_key}.json
+        - 同一个 worker 内只在 mtime 变化时才重新解析
+        - 返回的是共享对象，调用方不要修改
+        """
+        path = PaiweiLayoutService._json_path(file_key)
+        mtime = os.stat(path).st_mtime_ns
+
+        with PaiweiLayoutService._lock:
+            cached = PaiweiLayoutService._json_cache.get(path)
+            if cached and cached[0] == mtime:
+                return cached[1]
+
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+
+            PaiweiLayoutService._json_cache[path] = (mtime, data)
+            return data
+
+    @staticmethod
+    def invalidate(file_key: str = None):
+        """写入点位文件后立即作废缓存；不传 file_key 则全部清空"""
+        with PaiweiLayoutService._lock:
+            if file_key is None:
+                PaiweiLayoutService._json_cache.clear()
+                PaiweiLayoutService._font_mtime = None
+            else:
+                PaiweiLayoutService._json_cache.pop(
+                    PaiweiLayoutService._json_path(file_key), None
+                )
+
+    # ========= 对外方法 =========
+
+    @staticmethod
+    def get_source_name(paiwei_type: str):
+        return PaiweiLayoutService.TEMPLATE_BY_CODE.get(paiwei_type)
+
+    @staticmethod
+    def get_point_data(paiwei_type: str):
+        """
+        原 get_point_data：返回 (point_data, souce_name)
+        """
+        souce_name = PaiweiLayoutService.get_source_name(paiwei_type)
+        if not souce_name:
+            return None, None
+
+        for entry in PaiweiLayoutService.load_json("point"):
+            if souce_name in entry:
+                return entry[souce_name], souce_name
+
+        return None, souce_name
+
+    @staticmethod
+    def get_owner_point(souce_name: str):
+        suffix = PaiweiLayoutService.POINT_SUFFIX_BY_TEMPLATE.get(souce_name, "C")
+        return PaiweiLayoutService.load_json(f"owner_point_{suffix}")
+
+    @staticmethod
+    def get_deceased_point(souce_name: str):
+        suffix = PaiweiLayoutService.POINT_SUFFIX_BY_TEMPLATE.get(souce_name, "C")
+        return PaiweiLayoutService.load_json(f"deceased_point_{suffix}")
+
+    @staticmethod
+    def register_font() -> str:
+        """
+        注册 TW-Kai 字体；kai.ttf 没变就不重复解析
+        """
+        font_path = os.path.join(data_path, PaiweiLayoutService.FONT_FILE)
+        mtime = os.stat(font_path).st_mtime_ns
+
+        with PaiweiLayoutService._lock:
+            registered = PaiweiLayoutService.FONT_NAME in pdfmetrics.getRegisteredFontNames()
+            if not registered or PaiweiLayoutService._font_mtime != mtime:
+                pdfmetrics.registerFont(TTFont(PaiweiLayoutService.FONT_NAME, font_path))
+                PaiweiLayoutService._font_mtime = mtime
+
+        return PaiweiLayoutService.FONT_NAME
+
+    @staticmethod
+    def layout_signature(souce_name: str) -> list:
+        """
+        模板相关文件的 mtime，用来给缩略图缓存做 key
+        - 点位 / 模板 / 字体任何一个变了，缓存自然失效
+        """
+        suffix = PaiweiLayoutService.POINT_SUFFIX_BY_TEMPLATE.get(souce_name, "C")
+        paths = [
+            PaiweiLayoutService._json_path("point"),
+            PaiweiLayoutService._json_path(f"owner_point_{suffix}"),
+            PaiweiLayoutService._json_path(f"deceased_point_{suffix}"),
+            os.path.join(data_path, "paiwei_template", f"{souce_name}.pdf"),
+            os.path.join(data_path, PaiweiLayoutService.FONT_FILE),
+        ]
+
+        signature = []
+        for path in paths:
+            try:
+                signature.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                signature.append(None)
+        return signature
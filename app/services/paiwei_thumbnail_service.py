@@ -0,0 +1,128 @@
+# services/paiwei_thumbnail_service.py
+
+import glob
+import hashlib
+import io
+import json
+import os
+import threading
+
+from app.function.config import data_path, PAIWEI_THUMB_CACHE_MAX_BYTES
+from app.services.paiwei_layout_service import PaiweiLayoutService
+
+
+class PaiweiThumbnailService:
+    """PrintPDF 缩略图磁盘缓存：按打印内容做 key，超出容量按 LRU 淘汰"""
+
+    _evict_lock = threading.Lock()
+
+    # ========= 基础工具 =========
+
+    @staticmethod
+    def cache_dir() -> str:
+        path = os.path.join(data_path, "paiwei_result", "paiweicache")
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    @staticmethod
+    def content_key(print_data: list) -> str:
+        """
+        print_data: filter_fahui_data 的结果（渲染前，未经 A3/B3 处理）
+        - 内容 + 模板签名一起哈希，任何一边变了 key 就变
+        """
+        templates = sorted({
+            PaiweiLayoutService.get_source_name(item.get("code")) or ""
+            for item in print_data
+        })
+        payload = {
+            "data": print_data,
+            "layout": {name: PaiweiLayoutService.layout_signature(name) for name in templates},
+        }
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:24]
+
+    @staticmethod
+    def cache_path(print_pdf_id: int, key: str) -> str:
+        return os.path.join(
+            PaiweiThumbnailService.cache_dir(), f"{print_pdf_id}_{key}.jpeg"
+        )
+
+    # ========= 对外方法 =========
+
+    @staticmethod
+    def get(print_pdf_id: int, key: str):
+        """命中返回文件路径（顺便刷新 mtime 作为 LRU 时间），没命中返回 None"""
+        path = PaiweiThumbnailService.cache_path(print_pdf_id, key)
+        try:
+            os.utime(path, None)
+        except OSError:
+            return None
+        return path
+
+    @staticmethod
+    def put(print_pdf_id: int, key: str, image) -> str:
+        """保存 PIL 图片"""
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG")
+        return PaiweiThumbnailService.put_bytes(print_pdf_id, key, buffer.getvalue())
+
+    @staticmethod
+    def put_bytes(print_pdf_id: int, key: str, data: bytes) -> str:
+        """保存 jpeg bytes；同一个 print_pdf_id 的旧版本顺手删掉"""
+        path = PaiweiThumbnailService.cache_path(print_pdf_id, key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        PaiweiThumbnailService.discard(print_pdf_id, keep=path)
+        PaiweiThumbnailService.evict()
+        return path
+
+    @staticmethod
+    def discard(print_pdf_id: int, keep: str = None):
+        """删掉某个 print_pdf_id 的缓存（包括旧版 {id}.jpeg）"""
+        cache_dir = PaiweiThumbnailService.cache_dir()
+        paths = glob.glob(os.path.join(cache_dir, f"{print_pdf_id}_*.jpeg"))
+        paths.append(os.path.join(cache_dir, f"{print_pdf_id}.jpeg"))
+
+        for path in paths:
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def evict(max_bytes: int = PAIWEI_THUMB_CACHE_MAX_BYTES):
+        """总大小超过 max_bytes 时，从最久没用的开始删"""
+        if not PaiweiThumbnailService._evict_lock.acquire(blocking=False):
+            return  # 别的线程正在清理
+
+        try:
+            entries = []
+            total = 0
+            with os.scandir(PaiweiThumbnailService.cache_dir()) as it:
+                for entry in it:
+                    if not entry.is_file() or not entry.name.endswith(".jpeg"):
+                        continue
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+
+            if total <= max_bytes:
+                return
+
+            entries.sort()
+            for _, size, path in entries:
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                if total <= max_bytes:
+                    break
+        finally:
+            PaiweiThumbnailService._evict_lock.release()
@@ -0,0 +1,230 @@
+# services/print_job_service.py
+
+import json
+import os
+import re
+import time
+import uuid
+
+import redis
+
+from app.function.config import data_path
+from app.function.redis_client import redis_client
+
+
+class PrintJobService:
+    """后台打印任务：队列 / 状态 / 进度都放在本机 Redis，产物放在 data_path/print_jobs"""
+
+    QUEUE_KEY = "print_job:queue"
+    RUNNING_KEY = "print_job:running"  # zset：job_id -> 最后一次心跳时间
+    QUEUED_KEY = "print_job:queued"    # zset：job_id -> 入队时间，claim 成功才移除
+    JOB_TTL = 24 * 3600  # 任务状态和产物保留 1 天
+
+    HEARTBEAT_INTERVAL = 30
+    HEARTBEAT_TIMEOUT = 180  # 这么久没心跳就当 worker 已经挂了
+    LOST_QUEUED_TIMEOUT = 60  # queued 这么久、又不在队列里：被 pop 之后 worker 没来得及 claim 就挂了
+
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+
+    # ========= 基础工具 =========
+
+    @staticmethod
+    def _key(job_id: str) -> str:
+        return f"print_job:{job_id}"
+
+    @staticmethod
+    def is_valid_id(job_id: str) -> bool:
+        return bool(job_id and re.fullmatch(r"[0-9a-f]{32}", job_id))
+
+    @staticmethod
+    def artifact_dir() -> str:
+        path = os.path.join(data_path, "print_jobs")
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    @staticmethod
+    def artifact_path(job_id: str) -> str:
+        return os.path.join(PrintJobService.artifact_dir(), f"{job_id}.zip")
+
+    # ========= Web 端 =========
+
+    @staticmethod
+    def enqueue(params: dict) -> str:
+        job_id = uuid.uuid4().hex
+        key = PrintJobService._key(job_id)
+
+        pipe = redis_client.pipeline()
+        pipe.hset(key, mapping={
+            "status": PrintJobService.STATUS_QUEUED,
+            "params": json.dumps(params),
+            "created_at": int(time.time()),
+            "total_pages": 0,
+            "done_pages": 0,
+        })
+        pipe.expire(key, PrintJobService.JOB_TTL)
+        pipe.rpush(PrintJobService.QUEUE_KEY, job_id)
+        pipe.zadd(PrintJobService.QUEUED_KEY, {job_id: int(time.time())})
+        pipe.execute()
+
+        return job_id
+
+    @staticmethod
+    def get(job_id: str) -> dict | None:
+        if not PrintJobService.is_valid_id(job_id):
+            return None
+
+        data = redis_client.hgetall(PrintJobService._key(job_id))
+        if not data:
+            return None
+
+        total = int(data.get("total_pages") or 0)
+        done = int(data.get("done_pages") or 0)
+
+        return {
+            "job_id": job_id,
+            "status": data.get("status"),
+            "params": json.loads(data.get("params") or "{}"),
+            "created_at": int(data.get("created_at") or 0),
+            "total_pages": total,
+            "done_pages": done,
+            "progress": round(done / total, 4) if total else 0,
+            "error": data.get("error"),
+            "started_at": int(data.get("started_at") or 0),
+            "heartbeat_at": int(data.get("heartbeat_at") or 0),
+        }
+
+    # ========= Worker 端 =========
+
+    @staticmethod
+    def pop(timeout: int = 5) -> str | None:
+        """阻塞取下一个任务 id，超时返回 None"""
+        result = redis_client.blpop(PrintJobService.QUEUE_KEY, timeout=timeout)
+        return result[1] if result else None
+
+    @staticmethod
+    def claim(job_id: str) -> bool:
+        """
+        worker 取到任务后立刻标记 running 并开始记心跳（之后挂掉也能被发现）
+        - 只有 queued → running 这一步是原子的（WATCH），重复入队的同一个任务只会被执行一次
+        - 任务状态已过期 / 不存在 / 已被别的 worker 拿走返回 False
+        """
+        key = PrintJobService._key(job_id)
+        with redis_client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                status = pipe.hget(key, "status")
+                if status != PrintJobService.STATUS_QUEUED:
+                    pipe.unwatch()
+                    if status is None:
+                        redis_client.zrem(PrintJobService.QUEUED_KEY, job_id)
+                    return False
+
+                now = int(time.time())
+                pipe.multi()
+                pipe.hset(key, mapping={
+                    "status": PrintJobService.STATUS_RUNNING,
+                    "started_at": now,
+                    "heartbeat_at": now,
+                })
+                pipe.zadd(PrintJobService.RUNNING_KEY, {job_id: now})
+                pipe.zrem(PrintJobService.QUEUED_KEY, job_id)
+                pipe.execute()
+                return True
+            except redis.WatchError:
+                return False
+
+    @staticmethod
+    def heartbeat(job_id: str):
+        now = int(time.time())
+        pipe = redis_client.pipeline()
+        pipe.hset(PrintJobService._key(job_id), "heartbeat_at", now)
+        pipe.zadd(PrintJobService.RUNNING_KEY, {job_id: now}, xx=True)
+        pipe.execute()
+
+    @staticmethod
+    def start(job_id: str, total_pages: int):
+        redis_client.hset(PrintJobService._key(job_id), mapping={
+            "status": PrintJobService.STATUS_RUNNING,
+            "total_pages": total_pages,
+            "done_pages": 0,
+        })
+
+    @staticmethod
+    def add_progress(job_id: str, pages: int = 1):
+        redis_client.hincrby(PrintJobService._key(job_id), "done_pages", pages)
+
+    @staticmethod
+    def finish(job_id: str):
+        key = PrintJobService._key(job_id)
+        pipe = redis_client.pipeline()
+        pipe.hset(key, "status", PrintJobService.STATUS_DONE)
+        pipe.expire(key, PrintJobService.JOB_TTL)
+        pipe.zrem(PrintJobService.RUNNING_KEY, job_id)
+        pipe.execute()
+
+    @staticmethod
+    def fail(job_id: str, error: str):
+        key = PrintJobService._key(job_id)
+        pipe = redis_client.pipeline()
+        pipe.hset(key, mapping={"status": PrintJobService.STATUS_FAILED, "error": error})
+        pipe.expire(key, PrintJobService.JOB_TTL)
+        pipe.zrem(PrintJobService.RUNNING_KEY, job_id)
+        pipe.execute()
+
+    @staticmethod
+    def fail_stale_jobs(timeout: int = HEARTBEAT_TIMEOUT) -> list:
+        """心跳超时的 running 任务标记为 failed（worker 中途挂掉），返回这些 job_id"""
+        deadline = int(time.time()) - timeout
+        stale = redis_client.zrangebyscore(PrintJobService.RUNNING_KEY, 0, deadline)
+
+        failed = []
+        for job_id in stale:
+            # 只从 zset 里摘掉成功的那个 worker 负责标记，避免多个 worker 重复处理
+            if not redis_client.zrem(PrintJobService.RUNNING_KEY, job_id):
+                continue
+            status = redis_client.hget(PrintJobService._key(job_id), "status")
+            if status == PrintJobService.STATUS_RUNNING:
+                PrintJobService.fail(job_id, "worker 中断：心跳超时")
+                failed.append(job_id)
+        return failed
+
+    @staticmethod
+    def requeue_lost_jobs(timeout: int = LOST_QUEUED_TIMEOUT) -> list:
+        """
+        BLPOP 之后、claim 之前 worker 挂掉：任务已经出队但状态还是 queued，没人会再执行
+        queued 超过 timeout 又不在队列里的重新入队，返回这些 job_id
+        - 万一刚好是正在 claim 的任务被重复入队，claim 的原子检查会让它只执行一次
+        """
+        now = int(time.time())
+        candidates = redis_client.zrangebyscore(PrintJobService.QUEUED_KEY, 0, now - timeout)
+
+        requeued = []
+        for job_id in candidates:
+            status = redis_client.hget(PrintJobService._key(job_id), "status")
+            if status != PrintJobService.STATUS_QUEUED:
+                redis_client.zrem(PrintJobService.QUEUED_KEY, job_id)  # 已过期 / 已开始
+                continue
+            if redis_client.lpos(PrintJobService.QUEUE_KEY, job_id) is not None:
+                continue  # 还在排队，只是前面任务多
+
+            pipe = redis_client.pipeline()
+            pipe.rpush(PrintJobService.QUEUE_KEY, job_id)
+            pipe.zadd(PrintJobService.QUEUED_KEY, {job_id: now})
+            pipe.execute()
+            requeued.append(job_id)
+        return requeued
+
+    @staticmethod
+    def cleanup_artifacts(max_age: int = JOB_TTL):
+        """删掉过期任务的 zip"""
+        deadline = time.time() - max_age
+        with os.scandir(PrintJobService.artifact_dir()) as it:
+            for entry in it:
+                if entry.is_file() and entry.stat().st_mtime < deadline:
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
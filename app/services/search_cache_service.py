@@ -0,0 +1,129 @@
+# services/search_cache_service.py
+
+import hashlib
+import json
+
+import redis
+from flask import session
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from app.extensions import db
+from app.function.redis_client import redis_client
+from app.models.order_search import OrderSearchGram
+
+
+class SearchCacheService:
+    """
+    /fahui_router/search 结果缓存
+    - key = (generation, version, 规范化 value, page, per_page, 权限范围)
+    - 订单 / 明细 / 表单 / 付款 有写入 → 提交后 generation +1，旧 key 全部作废
+    - 登录 / 本人 / 匿名 的结果（电话是否打码）绝不共用同一个 key
+    """
+
+    GEN_KEY = "order_search:gen"
+    CACHE_TTL = 60
+    DIRTY_KEY = "order_search_cache_dirty"
+
+    # 这些表变了，搜索结果就可能变（payment_data 影响 status）
+    WATCHED_TABLES = {"orders", "order_items", "item_form_data", "payment_data"}
+
+    # ========= 基础工具 =========
+
+    @staticmethod
+    def _hash(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def auth_scope() -> str:
+        """
+        和 OrderService.to_dict 的打码规则一致：
+        - 登录：全部明文
+        - 未登录但 session 有 phone：只有本人的订单明文 → 每个 phone 单独一份
+        - 匿名：全部打码
+        """
+        if current_user and current_user.is_authenticated:
+            return "login"
+
+        session_phone = session.get("phone")
+        if session_phone:
+            return f"phone:{SearchCacheService._hash(str(session_phone))}"
+
+        return "anon"
+
+    @staticmethod
+    def _cache_key(generation: str, version, value: str, page_num: int, per_page: int) -> str:
+        value_hash = SearchCacheService._hash(value) if value else "-"
+        scope = SearchCacheService.auth_scope()
+        return f"order_search:{generation}:{version}:{value_hash}:{page_num}:{per_page}:{scope}"
+
+    @staticmethod
+    def bump_generation():
+        try:
+            redis_client.incr(SearchCacheService.GEN_KEY)
+        except redis.RedisError:
+            pass  # Redis 不在只是没缓存
+
+    # ========= 对外方法 =========
+
+    @staticmethod
+    def fetch(version, value: str, page_num: int, per_page: int, compute):
+        """命中直接返回；否则 compute() 并写入缓存"""
+        value = OrderSearchGram.normalize(value).strip()
+
+        try:
+            generation = redis_client.get(SearchCacheService.GEN_KEY) or "0"
+            key = SearchCacheService._cache_key(generation, version, value, page_num, per_page)
+            cached = redis_client.get(key)
+        except redis.RedisError:
+            key, cached = None, None
+
+        if cached:
+            return json.loads(cached)
+
+        result = compute()
+
+        if key:
+            try:
+                redis_client.set(key, json.dumps(result), ex=SearchCacheService.CACHE_TTL)
+            except redis.RedisError:
+                pass
+
+        return result
+
+
+# ========= ORM 事件：相关表写入 → 提交后作废搜索缓存 =========
+
+def search_cache_touch(mapper, connection, target):
+    if mapper.local_table.name not in SearchCacheService.WATCHED_TABLES:
+        return
+    session = object_session(target)
+    if session is not None:
+        session.info[SearchCacheService.DIRTY_KEY] = True
+
+
+for _event_name in ("after_insert", "after_update", "after_delete"):
+    event.listen(db.Model, _event_name, search_cache_touch, propagate=True)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def search_cache_bulk_write(orm_execute_state):
+    # query(...).update() / .delete()、批量 insert(Order) 都不走 mapper 事件，这里补上
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    table = mapper.local_table if mapper is not None else getattr(orm_execute_state.statement, "table", None)
+    if getattr(table, "name", None) in SearchCacheService.WATCHED_TABLES:
+        orm_execute_state.session.info[SearchCacheService.DIRTY_KEY] = True
+
+
+@event.listens_for(Session, "after_commit")
+def search_cache_after_commit(session):
+    if session.info.pop(SearchCacheService.DIRTY_KEY, False):
+        SearchCacheService.bump_generation()
+
+
+@event.listens_for(Session, "after_rollback")
+def search_cache_after_rollback(session):
+    session.info.pop(SearchCacheService.DIRTY_KEY, None)
@@ -0,0 +1,137 @@
+# services/table_generation_service.py
+
+import hashlib
+import uuid
+from functools import wraps
+
+import redis
+from flask import request, make_response
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from app.extensions import db
+from app.function.redis_client import redis_client
+
+
+class TableGenerationService:
+    """
+    每张表一个写入代数（Redis 计数器），ORM 写入提交后 +1
+    - 列表类接口用相关表的代数算 ETag，客户端带 If-None-Match 命中就直接 304
+    - epoch：Redis 被清空后计数器会归零，换一个 epoch 保证不会和旧 ETag 撞上
+    - +1 失败（Redis 闪断）：本进程记下 epoch_stale，Redis 一恢复就删掉 epoch 让所有 ETag 作废；
+      删掉之前本进程不再发 ETag
+    """
+
+    KEY_PREFIX = "table_gen:"
+    EPOCH_KEY = "table_gen:epoch"
+    DIRTY_KEY = "table_gen_dirty"
+
+    epoch_stale = False  # 本进程有一次 +1 没写进去
+
+    # ========= 计数器 =========
+
+    @staticmethod
+    def bump(tables):
+        tables = set(tables)
+        if not tables:
+            return
+        try:
+            TableGenerationService._rotate_stale_epoch()
+            pipe = redis_client.pipeline()
+            for table in sorted(tables):
+                pipe.incr(TableGenerationService.KEY_PREFIX + table)
+            pipe.execute()
+        except redis.RedisError:
+            # 写入已经提交，代数却没变：旧 ETag 会继续命中 304，必须作废
+            TableGenerationService.epoch_stale = True
+
+    @staticmethod
+    def _rotate_stale_epoch():
+        """之前有 +1 失败：删掉 epoch（下次读取生成新的），所有旧 ETag 一起作废"""
+        if TableGenerationService.epoch_stale:
+            redis_client.delete(TableGenerationService.EPOCH_KEY)
+            TableGenerationService.epoch_stale = False
+
+    @staticmethod
+    def generations(tables) -> list | None:
+        """返回 [epoch, gen1, gen2, ...]；Redis 不可用返回 None"""
+        keys = [TableGenerationService.KEY_PREFIX + t for t in tables]
+        try:
+            TableGenerationService._rotate_stale_epoch()
+            values = redis_client.mget([TableGenerationService.EPOCH_KEY] + keys)
+            if values[0] is None:
+                redis_client.set(TableGenerationService.EPOCH_KEY, uuid.uuid4().hex, nx=True)
+                values[0] = redis_client.get(TableGenerationService.EPOCH_KEY)
+        except redis.RedisError:
+            return None
+        return [v or "0" for v in values]
+
+    @staticmethod
+    def etag(tables, *parts) -> str | None:
+        generations = TableGenerationService.generations(tables)
+        if generations is None:
+            return None
+        raw = "|".join([*map(str, parts), *tables, *generations])
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def conditional_get(*tables):
+    """
+    GET 接口的 ETag / 304
+    - ETag = 路径 + 查询参数 + 相关表代数，计算时不碰数据库
+    - If-None-Match 命中直接 304，不执行视图函数
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            etag = TableGenerationService.etag(tables, request.full_path)
+            if etag is None:
+                return f(*args, **kwargs)
+
+            if etag in request.if_none_match:
+                response = make_response("", 304)
+                response.set_etag(etag)
+                return response
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+        return decorated_function
+    return decorator
+
+
+# ========= ORM 事件：记录写过的表，提交后统一 +1 =========
+
+def mark_table_dirty(session, table_name):
+    if session is not None and table_name:
+        session.info.setdefault(TableGenerationService.DIRTY_KEY, set()).add(table_name)
+
+
+def table_generation_touch(mapper, connection, target):
+    mark_table_dirty(object_session(target), mapper.local_table.name)
+
+
+for _event_name in ("after_insert", "after_update", "after_delete"):
+    event.listen(db.Model, _event_name, table_generation_touch, propagate=True)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def table_generation_bulk_write(orm_execute_state):
+    # query().update()/delete() 和 session.execute(insert(...)) 不走 mapper 事件
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    table = getattr(orm_execute_state.statement, "table", None)
+    mark_table_dirty(orm_execute_state.session, getattr(table, "name", None))
+
+
+@event.listens_for(Session, "after_commit")
+def table_generation_after_commit(session):
+    tables = session.info.pop(TableGenerationService.DIRTY_KEY, None)
+    if tables:
+        TableGenerationService.bump(tables)
+
+
+@event.listens_for(Session, "after_rollback")
+def table_generation_after_rollback(session):
+    session.info.pop(TableGenerationService.DIRTY_KEY, None)
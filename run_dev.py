@@ -1,6 +1,8 @@
 from app import create_app
+from app.extensions import socketio
 
 app = create_app(env="dev")
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5015, debug=True)
+    # socketio.run：开发环境也支持 websocket
+    socketio.run(app, host="0.0.0.0", port=5015, debug=True)
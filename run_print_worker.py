@@ -0,0 +1,64 @@
+import sys
+import threading
+import time
+
+from app import create_app
+from app.extensions import db
+from app.function.print_paiwei import run_print_job
+from app.services.print_job_service import PrintJobService
+
+# python run_print_worker.py [dev|prod]
+app = create_app(env=sys.argv[1] if len(sys.argv) > 1 else "prod")
+
+
+def keep_heartbeat(job_id, stop):
+    """任务执行期间定时写心跳；worker 挂了心跳就停，空闲的 worker 会把任务标成 failed"""
+    while not stop.wait(PrintJobService.HEARTBEAT_INTERVAL):
+        try:
+            PrintJobService.heartbeat(job_id)
+        except Exception as e:
+            print(f"print job {job_id} heartbeat failed: {e}", flush=True)
+
+
+def main():
+    print("print worker started", flush=True)
+    last_cleanup = 0
+
+    while True:
+        job_id = PrintJobService.pop(timeout=5)
+
+        if not job_id:
+            # 空闲时把心跳超时的 running 任务（worker 中途挂掉）标成 failed
+            for stale_id in PrintJobService.fail_stale_jobs():
+                print(f"print job {stale_id} marked failed (heartbeat timeout)", flush=True)
+
+            # 出队后还没 claim 就丢了的任务重新入队
+            for lost_id in PrintJobService.requeue_lost_jobs():
+                print(f"print job {lost_id} requeued (lost before claim)", flush=True)
+
+            # 顺便清理过期产物（最多每小时一次）
+            if time.time() - last_cleanup > 3600:
+                PrintJobService.cleanup_artifacts()
+                last_cleanup = time.time()
+            continue
+
+        if not PrintJobService.claim(job_id):
+            continue
+
+        print(f"print job {job_id} started", flush=True)
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=keep_heartbeat, args=(job_id, stop), daemon=True)
+        heartbeat.start()
+
+        with app.app_context():
+            try:
+                run_print_job(job_id)
+            finally:
+                stop.set()
+                heartbeat.join()
+                db.session.remove()
+        print(f"print job {job_id} finished", flush=True)
+
+
+if __name__ == "__main__":
+    main()
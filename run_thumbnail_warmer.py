@@ -0,0 +1,27 @@
+import sys
+
+from app import create_app
+from app.function.print_paiwei import warm_paiwei_thumbnails, reset_render_pool
+
+# python run_thumbnail_warmer.py [dev|prod] [board_id]
+app = create_app(env=sys.argv[1] if len(sys.argv) > 1 else "prod")
+
+
+def main():
+    board_id = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    with app.app_context():
+        try:
+            stats = warm_paiwei_thumbnails(board_id=board_id)
+        finally:
+            reset_render_pool()
+
+    print(
+        f"total={stats['total']} cached={stats['cached']} "
+        f"rendered={stats['rendered']} failed={stats['failed']}",
+        flush=True
+    )
+
+
+if __name__ == "__main__":
+    main()